@@ -1,21 +1,215 @@
+import asyncio
 import logging
+import re
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from database import DatabaseManager, Product, Category, Store, User
+from database import DatabaseManager, Product, Category, Store, User, ClickTracking, ClickStatsDaily
 from affiliate_manager import ProductScraper
+from product_scraper import AutomatedProductManager
+from sqlalchemy import select, update, delete, func, case, and_
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Seconds to reuse statistics totals between admin refreshes
+STATS_CACHE_TTL = 60
+
+# Telegram user ids allowed to use the admin panel
+_ADMIN_IDS = frozenset({Config.TELEGRAM_ADMIN_ID})
+
+# Seconds to reuse the top categories/stores rankings in analytics
+RANKINGS_CACHE_TTL = 300
+
+# Minimum seconds between progress edits of the same message
+PROGRESS_EDIT_INTERVAL = 2.0
+
+# Static keyboards are built once at import time and shared by every handler
+ADMIN_MAIN_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Statistics", callback_data="admin_stats")],
+    [InlineKeyboardButton("➕ Add Product", callback_data="admin_add_product"),
+     InlineKeyboardButton("📝 Manage Products", callback_data="admin_manage_products")],
+    [InlineKeyboardButton("🏪 Manage Stores", callback_data="admin_manage_stores"),
+     InlineKeyboardButton("📂 Manage Categories", callback_data="admin_manage_categories")],
+    [InlineKeyboardButton("👥 User Management", callback_data="admin_users"),
+     InlineKeyboardButton("📈 Analytics", callback_data="admin_analytics")],
+    [InlineKeyboardButton("🔄 Add Sample Data", callback_data="admin_sample_data")],
+    [InlineKeyboardButton("🤖 Auto-Scrape Products", callback_data="admin_auto_scrape")]
+])
+
+ADMIN_BACK_BUTTON = InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_main")
+ADMIN_BACK_MARKUP = InlineKeyboardMarkup([[ADMIN_BACK_BUTTON]])
+
+# Static screens, pre-rendered as HTML once: screen -> (text, markup)
+ADMIN_MAIN_HTML = (
+    "🛠️ <b>Admin Panel</b>\n\n"
+    "Welcome to the admin dashboard. Choose an option:"
+)
+
+ADD_PRODUCT_HTML = """
+➕ <b>Add New Product</b>
+
+To add a product, send me a message in this format:
+
+<pre>/addproduct
+Title: Product Name Here
+Price: 99.99
+Original Price: 129.99 (optional)
+Description: Product description here
+Category: electronics (or other category name)
+Store: Amazon (or other store name)
+URL: https://example.com/product-link
+Image: https://example.com/image.jpg (optional)
+Daily Deal: yes/no (optional)</pre>
+
+<b>Available Categories:</b>
+• electronics, mens_clothing, womens_clothing
+• beauty, household, kitchen, sports
+• books, toys, automotive, health
+
+<b>Example:</b>
+<pre>/addproduct
+Title: iPhone 15 Pro Max
+Price: 1199.99
+Original Price: 1299.99
+Description: Latest iPhone with advanced features
+Category: electronics
+Store: Amazon
+URL: https://amazon.com/dp/example
+Daily Deal: yes</pre>
+"""
+
+ADD_PRODUCT_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 View Sample Products", callback_data="admin_sample_data")],
+    [InlineKeyboardButton("🔙 Back to Products", callback_data="admin_manage_products")]
+])
+
+STATIC_SCREENS = {
+    "admin_main": (ADMIN_MAIN_HTML, ADMIN_MAIN_MARKUP),
+    "admin_add_product": (ADD_PRODUCT_HTML, ADD_PRODUCT_MARKUP),
+}
+
+# Message templates, filled with str.format_map / str.format per request
+STATS_TEMPLATE = """
+📊 **Bot Statistics**
+
+**Products:**
+• Total Products: {total_products}
+• Active Products: {active_products}
+• Daily Deals: {daily_deals}
+• New This Week: {new_products_week}
+
+**Users:**
+• Total Users: {total_users}
+• Active Users: {active_users}
+• New This Week: {new_users_week}
+
+**System:**
+• Categories: {total_categories}
+• Stores: {total_stores}
+
+**Database Status:** ✅ Connected
+**Last Updated:** {updated_at:%Y-%m-%d %H:%M:%S}
+"""
+
+PRODUCT_ROW_TEMPLATE = "{index}. {status} **{title}**\n   💰 ${price:.2f} | 🏪 {store}{deal}\n\n"
+
+ADD_PRODUCT_ROW = [InlineKeyboardButton("➕ Add New Product", callback_data="admin_add_product")]
+
+
+def _format_product_line(index, product):
+    """Render one product entry of the management list"""
+    return PRODUCT_ROW_TEMPLATE.format(
+        index=index,
+        status="✅" if product.is_active else "❌",
+        title=product.title[:40] + ('...' if len(product.title) > 40 else ''),
+        price=product.price,
+        store=product.store.name if product.store else 'No Store',
+        deal="🔥" if product.is_daily_deal else ""
+    )
+
+
+# (label, callback_data) formatters for the per-product action buttons
+_PRODUCT_ACTIONS = (
+    ("✏️ Edit {}".format, "admin_edit_product_{}".format),
+    ("🔄 Toggle {}".format, "admin_toggle_product_{}".format),
+    ("🗑️ Delete {}".format, "admin_delete_product_{}".format),
+)
+
+
+def _product_action_row(index, product_id):
+    """Build the edit/toggle/delete button row for one product"""
+    return [
+        InlineKeyboardButton(label(index), callback_data=callback(product_id))
+        for label, callback in _PRODUCT_ACTIONS
+    ]
+
+USER_MANAGEMENT_TEMPLATE = """
+👥 **User Management**
+
+**Overview:**
+• Total Users: {total_users}
+• Active Users: {active_users}
+• Inactive Users: {inactive_users}
+
+**Recent Users:**
+"""
+
+USER_ROW_TEMPLATE = "\n{index}. {status} **{name}** ({username})\n   ID: {telegram_id} | Joined: {joined:%Y-%m-%d}"
+
+ANALYTICS_TEMPLATE = """
+📈 **Analytics Dashboard**
+
+**Click Statistics:**
+• Total Clicks: {total_clicks}
+
+**Top Categories:**
+"""
+
+RANKING_ROW_TEMPLATE = "\n{index}. {name}: {count} products"
+
+# Callbacks carrying a product id, e.g. admin_delete_product_42
+PRODUCT_ACTION_PATTERN = re.compile(r"admin_(delete|toggle)_product_(\d+)$")
+
+# name -> id for categories and stores, filled on first lookup; neither
+# table is edited or deleted from anywhere in the bot
+_CATEGORY_IDS = {}
+_STORE_IDS = {}
+
+# "Field: value" lines of the /addproduct payload
+_FIELD_RE = re.compile(r"^[ \t]*([A-Za-z ]+?)[ \t]*:[ \t]*(.+?)[ \t]*$", re.M)
+
 class AdminPanel:
     def __init__(self):
         self.db = DatabaseManager()
         self.scraper = ProductScraper()
+        self._stats_cache = None  # (timestamp, stats dict)
+        self._rankings_cache = None  # (timestamp, (category_stats, store_stats))
+        self._background_tasks = set()  # strong refs so running tasks aren't collected
+        self._auto_manager = None  # AutomatedProductManager, built on first scrape
+        self._last_progress_edit = {}  # message_id -> monotonic time of last edit
+        
+        # Callback dispatch tables
+        self.callback_handlers = {
+            "admin_main": self.show_admin_main_menu,
+            "admin_stats": self.show_statistics,
+            "admin_add_product": self.show_add_product_form,
+            "admin_manage_products": self.show_manage_products,
+            "admin_users": self.show_user_management,
+            "admin_analytics": self.show_analytics,
+            "admin_sample_data": self.add_sample_data,
+            "admin_auto_scrape": self.start_auto_scraping
+        }
+        self.product_actions = {
+            "delete": self.delete_product,
+            "toggle": self.toggle_product_status
+        }
     
     def is_admin(self, user_id):
         """Check if user is admin"""
-        return user_id == Config.TELEGRAM_ADMIN_ID
+        return user_id in _ADMIN_IDS
     
     async def admin_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /admin command"""
@@ -25,25 +219,8 @@ class AdminPanel:
             await update.message.reply_text("❌ Access denied. Admin privileges required.")
             return
         
-        keyboard = [
-            [InlineKeyboardButton("📊 Statistics", callback_data="admin_stats")],
-            [InlineKeyboardButton("➕ Add Product", callback_data="admin_add_product"),
-             InlineKeyboardButton("📝 Manage Products", callback_data="admin_manage_products")],
-            [InlineKeyboardButton("🏪 Manage Stores", callback_data="admin_manage_stores"),
-             InlineKeyboardButton("📂 Manage Categories", callback_data="admin_manage_categories")],
-            [InlineKeyboardButton("👥 User Management", callback_data="admin_users"),
-             InlineKeyboardButton("📈 Analytics", callback_data="admin_analytics")],
-            [InlineKeyboardButton("🔄 Add Sample Data", callback_data="admin_sample_data")],
-            [InlineKeyboardButton("🤖 Auto-Scrape Products", callback_data="admin_auto_scrape")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            "🛠️ **Admin Panel**\n\n"
-            "Welcome to the admin dashboard. Choose an option:",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
+        text, reply_markup = STATIC_SCREENS["admin_main"]
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='HTML')
     
     async def handle_admin_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle admin panel callbacks"""
@@ -57,97 +234,93 @@ class AdminPanel:
         await query.answer()
         data = query.data
         
-        if data == "admin_main":
-            await self.show_admin_main_menu(query, context)
-        elif data == "admin_stats":
-            await self.show_statistics(query, context)
-        elif data == "admin_add_product":
-            await self.show_add_product_form(query, context)
-        elif data == "admin_manage_products":
-            await self.show_manage_products(query, context)
-        elif data == "admin_manage_stores":
-            await self.show_manage_stores(query, context)
-        elif data == "admin_manage_categories":
-            await self.show_manage_categories(query, context)
-        elif data == "admin_users":
-            await self.show_user_management(query, context)
-        elif data == "admin_analytics":
-            await self.show_analytics(query, context)
-        elif data == "admin_sample_data":
-            await self.add_sample_data(query, context)
-        elif data == "admin_auto_scrape":
-            await self.start_auto_scraping(query, context)
-        elif data.startswith("admin_delete_product_"):
-            product_id = int(data.replace("admin_delete_product_", ""))
-            await self.delete_product(query, context, product_id)
-        elif data.startswith("admin_toggle_product_"):
-            product_id = int(data.replace("admin_toggle_product_", ""))
-            await self.toggle_product_status(query, context, product_id)
+        handler = self.callback_handlers.get(data)
+        if handler:
+            await handler(query, context)
+            return
+        
+        match = PRODUCT_ACTION_PATTERN.match(data)
+        if match:
+            action = self.product_actions[match.group(1)]
+            await action(query, context, int(match.group(2)))
     
     async def show_admin_main_menu(self, query, context):
         """Show main admin menu"""
-        keyboard = [
-            [InlineKeyboardButton("📊 Statistics", callback_data="admin_stats")],
-            [InlineKeyboardButton("➕ Add Product", callback_data="admin_add_product"),
-             InlineKeyboardButton("📝 Manage Products", callback_data="admin_manage_products")],
-            [InlineKeyboardButton("🏪 Manage Stores", callback_data="admin_manage_stores"),
-             InlineKeyboardButton("📂 Manage Categories", callback_data="admin_manage_categories")],
-            [InlineKeyboardButton("👥 User Management", callback_data="admin_users"),
-             InlineKeyboardButton("📈 Analytics", callback_data="admin_analytics")],
-            [InlineKeyboardButton("🔄 Add Sample Data", callback_data="admin_sample_data")],
-            [InlineKeyboardButton("🤖 Auto-Scrape Products", callback_data="admin_auto_scrape")]
-        ]
+        text, reply_markup = STATIC_SCREENS["admin_main"]
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='HTML')
+    
+    async def _fetch_all(self, statement):
+        """Run a read-only statement on its own pooled session so callers can gather several"""
+        async with self.db.async_session_scope() as session:
+            return (await session.execute(statement)).all()
+    
+    @staticmethod
+    async def _find_id(session, model, **filters):
+        """Return the id of the first matching row, or None, without loading the row"""
+        return await session.scalar(select(model.id).filter_by(**filters).limit(1))
+    
+    @classmethod
+    async def _cached_id(cls, session, cache, model, name):
+        """Resolve a name to its id through the given cache, querying only on a miss"""
+        if name not in cache:
+            row_id = await cls._find_id(session, model, name=name)
+            if row_id is None:
+                return None
+            cache[name] = row_id
+        return cache[name]
+    
+    async def get_statistics(self):
+        """Get bot statistics, reusing recent totals within STATS_CACHE_TTL"""
+        now = time.monotonic()
+        if self._stats_cache and now - self._stats_cache[0] < STATS_CACHE_TTL:
+            return self._stats_cache[1]
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "🛠️ **Admin Panel**\n\n"
-            "Welcome to the admin dashboard. Choose an option:",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+        # Recent activity (last 7 days)
+        week_ago = datetime.now() - timedelta(days=7)
+        
+        # One query per table using conditional aggregates, run concurrently
+        product_rows, user_rows = await asyncio.gather(
+            self._fetch_all(select(
+                func.count(Product.id),
+                func.sum(case((Product.is_active == True, 1), else_=0)),
+                func.sum(case((and_(Product.is_daily_deal == True, Product.is_active == True), 1), else_=0)),
+                func.sum(case((Product.created_at >= week_ago, 1), else_=0))
+            )),
+            self._fetch_all(select(
+                func.count(User.id),
+                func.sum(case((User.is_active == True, 1), else_=0)),
+                func.sum(case((User.created_at >= week_ago, 1), else_=0)),
+                select(func.count(Category.id)).scalar_subquery(),
+                select(func.count(Store.id)).scalar_subquery()
+            ))
         )
+        product_totals, user_totals = product_rows[0], user_rows[0]
+        
+        stats = {
+            'total_products': product_totals[0],
+            'active_products': product_totals[1] or 0,
+            'daily_deals': product_totals[2] or 0,
+            'new_products_week': product_totals[3] or 0,
+            'total_users': user_totals[0],
+            'active_users': user_totals[1] or 0,
+            'new_users_week': user_totals[2] or 0,
+            'total_categories': user_totals[3] or 0,
+            'total_stores': user_totals[4] or 0,
+            'updated_at': datetime.now()
+        }
+        
+        self._stats_cache = (now, stats)
+        return stats
     
     async def show_statistics(self, query, context):
         """Show bot statistics"""
-        session = self.db.get_session()
+        stats = await self.get_statistics()
         
-        total_products = session.query(Product).count()
-        active_products = session.query(Product).filter_by(is_active=True).count()
-        daily_deals = session.query(Product).filter_by(is_daily_deal=True, is_active=True).count()
-        total_users = session.query(User).count()
-        active_users = session.query(User).filter_by(is_active=True).count()
-        total_categories = session.query(Category).count()
-        total_stores = session.query(Store).count()
-        
-        # Recent activity (last 7 days)
-        week_ago = datetime.now() - timedelta(days=7)
-        new_users_week = session.query(User).filter(User.created_at >= week_ago).count()
-        new_products_week = session.query(Product).filter(Product.created_at >= week_ago).count()
-        
-        message = f"""
-📊 **Bot Statistics**
-
-**Products:**
-• Total Products: {total_products}
-• Active Products: {active_products}
-• Daily Deals: {daily_deals}
-• New This Week: {new_products_week}
-
-**Users:**
-• Total Users: {total_users}
-• Active Users: {active_users}
-• New This Week: {new_users_week}
-
-**System:**
-• Categories: {total_categories}
-• Stores: {total_stores}
-
-**Database Status:** ✅ Connected
-**Last Updated:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-        """
+        message = STATS_TEMPLATE.format_map(stats)
         
         keyboard = [
             [InlineKeyboardButton("🔄 Refresh", callback_data="admin_stats")],
-            [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_main")]
+            [ADMIN_BACK_BUTTON]
         ]
         
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -155,102 +328,51 @@ class AdminPanel:
     
     async def show_manage_products(self, query, context):
         """Show product management interface"""
-        session = self.db.get_session()
-        
-        # Get recent products
-        products = session.query(Product).order_by(Product.created_at.desc()).limit(10).all()
-        
-        if not products:
-            keyboard = [
-                [InlineKeyboardButton("➕ Add First Product", callback_data="admin_add_product")],
-                [InlineKeyboardButton("🔙 Back", callback_data="admin_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
-                "📝 **Product Management**\n\nNo products found. Add your first product!",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-            return
-        
-        message = "📝 **Product Management**\n\nRecent Products:\n\n"
-        keyboard = []
-        
-        for i, product in enumerate(products, 1):
-            status_emoji = "✅" if product.is_active else "❌"
-            deal_emoji = "🔥" if product.is_daily_deal else ""
+        async with self.db.async_session_scope() as session:
+            # Get recent products with their stores in a single JOIN
+            products = (await session.execute(
+                select(Product).options(joinedload(Product.store)).order_by(Product.created_at.desc()).limit(10)
+            )).scalars().all()
             
-            message += f"{i}. {status_emoji} **{product.title[:40]}{'...' if len(product.title) > 40 else ''}**\n"
-            message += f"   💰 ${product.price:.2f} | 🏪 {product.store.name if product.store else 'No Store'}{deal_emoji}\n\n"
+            if not products:
+                keyboard = [
+                    [InlineKeyboardButton("➕ Add First Product", callback_data="admin_add_product")],
+                    [InlineKeyboardButton("🔙 Back", callback_data="admin_main")]
+                ]
+                reply_markup = InlineKeyboardMarkup(keyboard)
+                await query.edit_message_text(
+                    "📝 **Product Management**\n\nNo products found. Add your first product!",
+                    reply_markup=reply_markup,
+                    parse_mode='Markdown'
+                )
+                return
             
-            keyboard.append([
-                InlineKeyboardButton(f"✏️ Edit {i}", callback_data=f"admin_edit_product_{product.id}"),
-                InlineKeyboardButton(f"🔄 Toggle {i}", callback_data=f"admin_toggle_product_{product.id}"),
-                InlineKeyboardButton(f"🗑️ Delete {i}", callback_data=f"admin_delete_product_{product.id}")
-            ])
-        
-        keyboard.append([InlineKeyboardButton("➕ Add New Product", callback_data="admin_add_product")])
-        keyboard.append([InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_main")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+            # Render message lines and button rows in one pass, then split them
+            lines, rows = zip(*(
+                (_format_product_line(i, product), _product_action_row(i, product.id))
+                for i, product in enumerate(products, 1)
+            ))
+            
+            message = "📝 **Product Management**\n\nRecent Products:\n\n" + "".join(lines)
+            keyboard = list(rows) + [ADD_PRODUCT_ROW, [ADMIN_BACK_BUTTON]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
     
     async def show_add_product_form(self, query, context):
         """Show add product form instructions"""
-        message = """
-➕ **Add New Product**
-
-To add a product, send me a message in this format:
-
-```
-/addproduct
-Title: Product Name Here
-Price: 99.99
-Original Price: 129.99 (optional)
-Description: Product description here
-Category: electronics (or other category name)
-Store: Amazon (or other store name)
-URL: https://example.com/product-link
-Image: https://example.com/image.jpg (optional)
-Daily Deal: yes/no (optional)
-```
-
-**Available Categories:**
-• electronics, mens_clothing, womens_clothing
-• beauty, household, kitchen, sports
-• books, toys, automotive, health
-
-**Example:**
-```
-/addproduct
-Title: iPhone 15 Pro Max
-Price: 1199.99
-Original Price: 1299.99
-Description: Latest iPhone with advanced features
-Category: electronics
-Store: Amazon
-URL: https://amazon.com/dp/example
-Daily Deal: yes
-```
-        """
-        
-        keyboard = [
-            [InlineKeyboardButton("📝 View Sample Products", callback_data="admin_sample_data")],
-            [InlineKeyboardButton("🔙 Back to Products", callback_data="admin_manage_products")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+        text, reply_markup = STATIC_SCREENS["admin_add_product"]
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='HTML')
     
     async def add_sample_data(self, query, context):
         """Add sample data to database"""
         try:
             self.scraper.add_sample_products()
+            self._rankings_cache = None
             
             keyboard = [
                 [InlineKeyboardButton("📊 View Statistics", callback_data="admin_stats")],
                 [InlineKeyboardButton("📝 Manage Products", callback_data="admin_manage_products")],
-                [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_main")]
+                [ADMIN_BACK_BUTTON]
             ]
             
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -278,80 +400,93 @@ Daily Deal: yes
     
     async def show_user_management(self, query, context):
         """Show user management interface"""
-        session = self.db.get_session()
-        
-        total_users = session.query(User).count()
-        active_users = session.query(User).filter_by(is_active=True).count()
-        recent_users = session.query(User).order_by(User.created_at.desc()).limit(5).all()
-        
-        message = f"""
-👥 **User Management**
-
-**Overview:**
-• Total Users: {total_users}
-• Active Users: {active_users}
-• Inactive Users: {total_users - active_users}
-
-**Recent Users:**
-        """
-        
-        for i, user in enumerate(recent_users, 1):
-            username = f"@{user.username}" if user.username else "No username"
-            name = f"{user.first_name} {user.last_name or ''}".strip()
-            status = "✅" if user.is_active else "❌"
+        async with self.db.async_session_scope() as session:
+            total_users, active_users = (await session.execute(select(
+                func.count(User.id),
+                func.sum(case((User.is_active == True, 1), else_=0))
+            ))).one()
+            active_users = active_users or 0
+            recent_users = (await session.execute(
+                select(User).order_by(User.created_at.desc()).limit(5)
+            )).scalars().all()
             
-            message += f"\n{i}. {status} **{name}** ({username})"
-            message += f"\n   ID: {user.telegram_id} | Joined: {user.created_at.strftime('%Y-%m-%d')}"
-        
-        keyboard = [
-            [InlineKeyboardButton("📊 User Analytics", callback_data="admin_user_analytics")],
-            [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_main")]
-        ]
+            parts = [USER_MANAGEMENT_TEMPLATE.format_map({
+                'total_users': total_users,
+                'active_users': active_users,
+                'inactive_users': total_users - active_users
+            })]
+            parts.extend(
+                USER_ROW_TEMPLATE.format(
+                    index=i,
+                    status="✅" if user.is_active else "❌",
+                    name=f"{user.first_name} {user.last_name or ''}".strip(),
+                    username=f"@{user.username}" if user.username else "No username",
+                    telegram_id=user.telegram_id,
+                    joined=user.created_at
+                )
+                for i, user in enumerate(recent_users, 1)
+            )
+            message = "".join(parts)
+            
+            keyboard = [
+                [InlineKeyboardButton("📊 User Analytics", callback_data="admin_user_analytics")],
+                [ADMIN_BACK_BUTTON]
+            ]
+            
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+    
+    async def get_rankings(self):
+        """Get top categories and stores by product count, cached for RANKINGS_CACHE_TTL"""
+        now = time.monotonic()
+        if self._rankings_cache and now - self._rankings_cache[0] < RANKINGS_CACHE_TTL:
+            return self._rankings_cache[1]
+        
+        rankings = await asyncio.gather(
+            # Top categories by product count
+            self._fetch_all(select(
+                Category.display_name,
+                func.count(Product.id).label('product_count')
+            ).join(Product).group_by(Category.id).order_by(func.count(Product.id).desc()).limit(5)),
+            # Top stores by product count
+            self._fetch_all(select(
+                Store.name,
+                func.count(Product.id).label('product_count')
+            ).join(Product).group_by(Store.id).order_by(func.count(Product.id).desc()).limit(5))
+        )
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+        self._rankings_cache = (now, rankings)
+        return rankings
     
     async def show_analytics(self, query, context):
         """Show detailed analytics"""
-        session = self.db.get_session()
-        
-        # Get click statistics
-        from sqlalchemy import func
-        click_stats = session.query(
-            func.count().label('total_clicks')
-        ).first()
-        
-        # Top categories by product count
-        category_stats = session.query(
-            Category.display_name,
-            func.count(Product.id).label('product_count')
-        ).join(Product).group_by(Category.id).order_by(func.count(Product.id).desc()).limit(5).all()
-        
-        # Top stores by product count
-        store_stats = session.query(
-            Store.name,
-            func.count(Product.id).label('product_count')
-        ).join(Product).group_by(Store.id).order_by(func.count(Product.id).desc()).limit(5).all()
-        
-        message = f"""
-📈 **Analytics Dashboard**
-
-**Click Statistics:**
-• Total Clicks: {click_stats.total_clicks if click_stats else 0}
-
-**Top Categories:**
-        """
-        
-        for i, (category, count) in enumerate(category_stats, 1):
-            message += f"\n{i}. {category}: {count} products"
-        
-        message += "\n\n**Top Stores:**"
-        for i, (store, count) in enumerate(store_stats, 1):
-            message += f"\n{i}. {store}: {count} products"
+        # Independent queries run concurrently on separate pooled connections
+        click_rows, (category_stats, store_stats) = await asyncio.gather(
+            # Get click statistics
+            self._fetch_all(select(
+                func.count().label('total_clicks')
+            ).select_from(ClickTracking)),
+            self.get_rankings()
+        )
+        click_stats = click_rows[0] if click_rows else None
+        
+        parts = [ANALYTICS_TEMPLATE.format_map({
+            'total_clicks': click_stats.total_clicks if click_stats else 0
+        })]
+        parts.extend(
+            RANKING_ROW_TEMPLATE.format(index=i, name=category, count=count)
+            for i, (category, count) in enumerate(category_stats, 1)
+        )
+        parts.append("\n\n**Top Stores:**")
+        parts.extend(
+            RANKING_ROW_TEMPLATE.format(index=i, name=store, count=count)
+            for i, (store, count) in enumerate(store_stats, 1)
+        )
+        message = "".join(parts)
         
         keyboard = [
             [InlineKeyboardButton("🔄 Refresh", callback_data="admin_analytics")],
-            [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_main")]
+            [ADMIN_BACK_BUTTON]
         ]
         
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -359,39 +494,55 @@ Daily Deal: yes
     
     async def delete_product(self, query, context, product_id):
         """Delete a product"""
-        session = self.db.get_session()
-        product = session.query(Product).filter_by(id=product_id).first()
-        
-        if product:
-            product_title = product.title
-            session.delete(product)
-            session.commit()
-            
-            await query.edit_message_text(
-                f"✅ **Product Deleted**\n\n"
-                f"Successfully deleted: **{product_title}**",
-                parse_mode='Markdown'
+        async with self.db.async_session_scope() as session:
+            # Detach the product's rows first, as the ORM delete used to: keep its
+            # clicks without a product and drop its daily click totals
+            await session.execute(
+                update(ClickTracking).where(ClickTracking.product_id == product_id).values(product_id=None)
             )
-        else:
-            await query.edit_message_text("❌ Product not found!")
+            await session.execute(
+                delete(ClickStatsDaily).where(ClickStatsDaily.product_id == product_id)
+            )
+            
+            # Delete and fetch the title in a single statement
+            deleted = (await session.execute(
+                delete(Product).where(Product.id == product_id).returning(Product.title)
+            )).first()
+            
+            if deleted:
+                await session.commit()
+                self._rankings_cache = None
+                
+                await query.edit_message_text(
+                    f"✅ **Product Deleted**\n\n"
+                    f"Successfully deleted: **{deleted.title}**",
+                    parse_mode='Markdown'
+                )
+            else:
+                await query.edit_message_text("❌ Product not found!")
     
     async def toggle_product_status(self, query, context, product_id):
         """Toggle product active status"""
-        session = self.db.get_session()
-        product = session.query(Product).filter_by(id=product_id).first()
-        
-        if product:
-            product.is_active = not product.is_active
-            session.commit()
+        async with self.db.async_session_scope() as session:
+            # Flip the flag and read back the new state in a single statement
+            product = (await session.execute(
+                update(Product)
+                .where(Product.id == product_id)
+                .values(is_active=~Product.is_active)
+                .returning(Product.title, Product.is_active)
+            )).first()
             
-            status = "activated" if product.is_active else "deactivated"
-            await query.edit_message_text(
-                f"✅ **Product {status.title()}**\n\n"
-                f"**{product.title}** has been {status}.",
-                parse_mode='Markdown'
-            )
-        else:
-            await query.edit_message_text("❌ Product not found!")
+            if product:
+                await session.commit()
+                
+                status = "activated" if product.is_active else "deactivated"
+                await query.edit_message_text(
+                    f"✅ **Product {status.title()}**\n\n"
+                    f"**{product.title}** has been {status}.",
+                    parse_mode='Markdown'
+                )
+            else:
+                await query.edit_message_text("❌ Product not found!")
     
     async def process_add_product_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Process /addproduct command with product details"""
@@ -401,14 +552,8 @@ Daily Deal: yes
             await update.message.reply_text("❌ Access denied. Admin privileges required.")
             return
         
-        text = update.message.text
-        lines = text.split('\n')[1:]  # Skip the /addproduct line
-        
-        product_data = {}
-        for line in lines:
-            if ':' in line:
-                key, value = line.split(':', 1)
-                product_data[key.strip().lower()] = value.strip()
+        # The leading /addproduct line never matches, so parse the whole text
+        product_data = {m.group(1).lower(): m.group(2) for m in _FIELD_RE.finditer(update.message.text)}
         
         # Validate required fields
         required_fields = ['title', 'price', 'category', 'store', 'url']
@@ -425,61 +570,55 @@ Daily Deal: yes
         
         try:
             # Add product to database
-            session = self.db.get_session()
-            
-            # Get or create category
-            category = session.query(Category).filter_by(name=product_data['category']).first()
-            if not category:
-                await update.message.reply_text(f"❌ Category '{product_data['category']}' not found!")
-                return
-            
-            # Get or create store
-            store = session.query(Store).filter_by(name=product_data['store']).first()
-            if not store:
-                store = Store(name=product_data['store'])
-                session.add(store)
-                session.commit()
-            
-            # Generate affiliate link
-            from affiliate_manager import AffiliateManager
-            affiliate_manager = AffiliateManager()
-            affiliate_url = affiliate_manager.generate_affiliate_link(
-                product_data['url'],
-                product_data['store'],
-                product_data['title']
-            )
-            
-            # Create product
-            product = Product(
-                title=product_data['title'],
-                description=product_data.get('description', ''),
-                price=float(product_data['price']),
-                original_price=float(product_data['original price']) if 'original price' in product_data else None,
-                product_url=product_data['url'],
-                affiliate_url=affiliate_url,
-                image_url=product_data.get('image'),
-                category_id=category.id,
-                store_id=store.id,
-                is_daily_deal=product_data.get('daily deal', '').lower() in ['yes', 'true', '1']
-            )
-            
-            # Calculate discount if original price provided
-            if product.original_price and product.price:
-                product.discount_percentage = ((product.original_price - product.price) / product.original_price) * 100
-            
-            session.add(product)
-            session.commit()
-            
-            await update.message.reply_text(
-                f"✅ **Product Added Successfully!**\n\n"
-                f"**Title:** {product.title}\n"
-                f"**Price:** ${product.price:.2f}\n"
-                f"**Category:** {category.display_name}\n"
-                f"**Store:** {store.name}\n"
-                f"**Daily Deal:** {'Yes' if product.is_daily_deal else 'No'}\n\n"
-                f"Product is now available in the bot!",
-                parse_mode='Markdown'
-            )
+            async with self.db.async_session_scope() as session:
+                # Look up category (only its id is needed)
+                category_id = await self._cached_id(session, _CATEGORY_IDS, Category, product_data['category'])
+                if category_id is None:
+                    await update.message.reply_text(f"❌ Category '{product_data['category']}' not found!")
+                    return
+                
+                # Get or create store
+                store_id = await self._cached_id(session, _STORE_IDS, Store, product_data['store'])
+                if store_id is None:
+                    store = Store(name=product_data['store'])
+                    session.add(store)
+                    await session.commit()
+                    store_id = _STORE_IDS[store.name] = store.id
+                
+                # Generate affiliate link, reusing the scraper's manager
+                affiliate_url = self.scraper.affiliate_manager.generate_affiliate_link(
+                    product_data['url'],
+                    product_data['store']
+                )
+                
+                # Create product
+                product = Product(
+                    title=product_data['title'],
+                    description=product_data.get('description', ''),
+                    price=float(product_data['price']),
+                    original_price=float(product_data['original price']) if 'original price' in product_data else None,
+                    product_url=product_data['url'],
+                    affiliate_url=affiliate_url,
+                    image_url=product_data.get('image'),
+                    category_id=category_id,
+                    store_id=store_id,
+                    is_daily_deal=product_data.get('daily deal', '').lower() in ['yes', 'true', '1']
+                )
+                
+                session.add(product)
+                await session.commit()
+                self._rankings_cache = None
+                
+                await update.message.reply_text(
+                    f"✅ **Product Added Successfully!**\n\n"
+                    f"**Title:** {product.title}\n"
+                    f"**Price:** ${product.price:.2f}\n"
+                    f"**Category:** {' '.join(Config.CATEGORIES.get(product_data['category'], (product_data['category'],)))}\n"
+                    f"**Store:** {product_data['store']}\n"
+                    f"**Daily Deal:** {'Yes' if product.is_daily_deal else 'No'}\n\n"
+                    f"Product is now available in the bot!",
+                    parse_mode='Markdown'
+                )
             
         except Exception as e:
             logger.error(f"Error adding product: {e}")
@@ -502,16 +641,45 @@ Daily Deal: yes
             "⏳ Please wait, this may take a few minutes...",
             parse_mode='Markdown'
         )
+        self._last_progress_edit[query.message.message_id] = time.monotonic()
+        
+        # Scraping takes minutes; run it in the background so other admin
+        # callbacks keep being served, and report back on the same message
+        task = asyncio.create_task(self._run_auto_scraping(query))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def _edit_progress(self, query, stage):
+        """Show a scraping stage, skipping edits within PROGRESS_EDIT_INTERVAL of the last one"""
+        message_id = query.message.message_id
+        now = time.monotonic()
+        if now - self._last_progress_edit.get(message_id, 0) < PROGRESS_EDIT_INTERVAL:
+            return
+        self._last_progress_edit[message_id] = now
         
         try:
-            from product_scraper import AutomatedProductManager
-            manager = AutomatedProductManager()
-            await manager.run_automated_scraping()
+            await query.edit_message_text(
+                f"🤖 **Automated Product Scraping**\n\n⏳ {stage}",
+                parse_mode='Markdown'
+            )
+        except Exception as e:
+            # Progress is best-effort; the final edit reports the outcome
+            logger.debug(f"Skipped progress update: {e}")
+    
+    async def _run_auto_scraping(self, query):
+        """Run automated scraping and edit the status message when done"""
+        try:
+            if self._auto_manager is None:
+                self._auto_manager = AutomatedProductManager()
+            await self._auto_manager.run_automated_scraping(
+                progress_callback=lambda stage: self._edit_progress(query, stage)
+            )
+            self._rankings_cache = None
             
             keyboard = [
                 [InlineKeyboardButton("📊 View Statistics", callback_data="admin_stats")],
                 [InlineKeyboardButton("📝 Manage Products", callback_data="admin_manage_products")],
-                [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_main")]
+                [ADMIN_BACK_BUTTON]
             ]
             
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -530,14 +698,12 @@ Daily Deal: yes
             
         except Exception as e:
             logger.error(f"Auto-scraping error: {e}")
-            keyboard = [
-                [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
             await query.edit_message_text(
                 f"❌ **Error During Auto-Scraping**\n\n"
                 f"Error: {str(e)}\n\n"
                 "Please check the logs for more details.",
-                reply_markup=reply_markup,
+                reply_markup=ADMIN_BACK_MARKUP,
                 parse_mode='Markdown'
             )
+        finally:
+            self._last_progress_edit.pop(query.message.message_id, None)
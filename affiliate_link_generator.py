@@ -3,51 +3,170 @@ Real Affiliate Link Generator for Multiple Networks
 Handles Amazon Associates, eBay Partner Network, AliExpress, and other affiliate programs
 """
 
+import asyncio
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import hashlib
 import hmac
 import base64
 import time
 import json
 import re
-from urllib.parse import urlencode, quote, urlparse, parse_qs
+import string
+from functools import lru_cache
+from urllib.parse import urlencode, quote, quote_plus, urlparse, parse_qs
+from sqlalchemy import update, or_, and_
 from config import Config
 from database import DatabaseManager, Product, Store
 import logging
 
+# URL patterns run on untrusted links; use RE2's linear-time engine when
+# google-re2 is installed and fall back to the standard library otherwise
+try:
+    import re2 as re_url
+except ImportError:
+    re_url = re
+
 logger = logging.getLogger(__name__)
 
+# Product id patterns, each a single alternation so a URL is scanned once.
+# Exactly one group participates in a match, so it is match.lastindex.
+_AMAZON_ASIN_RE = re_url.compile(
+    r'(?:/dp/|/gp/product/|/product/|asin=)([A-Z0-9]{10})'
+    r'|/([A-Z0-9]{10})(?:[/?]|$)'
+)
+
+_EBAY_ITEM_RE = re_url.compile(r'/itm/([0-9]+)|item=([0-9]+)|/([0-9]{12,})')
+
+def create_http_session(headers=None):
+    """Create a keep-alive requests session with a shared connection pool and light retries"""
+    session = requests.Session()
+    if headers:
+        session.headers.update(headers)
+    adapter = HTTPAdapter(
+        pool_connections=20,
+        pool_maxsize=50,
+        max_retries=Retry(total=2, backoff_factor=0.3)
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# Affiliate links normally resolve within a couple of hops; a longer chain
+# is treated as broken rather than followed
+MAX_VALIDATION_REDIRECTS = 3
+
+@lru_cache(maxsize=16384)
+def _query_separator(url):
+    """Return the character that appends a parameter to url (memoized per URL)"""
+    return "&" if "?" in url else "?"
+
+@lru_cache(maxsize=8192)
+def _quoted_url(url):
+    """Percent-encode a product URL for embedding in a redirect link (memoized)"""
+    return quote(url)
+
+@lru_cache(maxsize=16384)
+def _extract_amazon_asin(url):
+    """Extract ASIN from Amazon URL (memoized; link refreshes see the same URLs)"""
+    match = _AMAZON_ASIN_RE.search(url)
+    return match.group(match.lastindex) if match else None
+
+@lru_cache(maxsize=16384)
+def _extract_ebay_item_id(url):
+    """Extract item ID from eBay URL (memoized)"""
+    match = _EBAY_ITEM_RE.search(url)
+    return match.group(match.lastindex) if match else None
+
+# eBay rover link; everything but the campaign id, item and timestamp is fixed
+_EBAY_ROVER_URL = "https://rover.ebay.com/rover/1/711-53200-19255-0/1"
+_EBAY_FIXED_PARAMS = {
+    'icep_ff3': '2',
+    'toolid': '10001',
+    'campid': '5338452986',
+    'customid': '',
+    'ipn': 'psmain',
+    'icep_vectorid': '229466',
+    'kwid': '902099',
+    'mtid': '824',
+    'kw': 'lg',
+    'srcrot': '711-53200-19255-0',
+    'rvr_id': '2348474186'
+}
+
+# Constant UTM parameters of generic tracking links, pre-encoded
+_UTM_PREFIX = urlencode({
+    'utm_source': 'telegram_bot',
+    'utm_medium': 'affiliate',
+    'utm_campaign': 'deals_bot'
+})
+
+# Lowercases ASCII letters and turns spaces into underscores in one pass
+_UTM_CONTENT_TABLE = str.maketrans(
+    {**{c: c.lower() for c in string.ascii_uppercase}, ' ': '_'}
+)
+
+@lru_cache(maxsize=1024)
+def _utm_query(store_name):
+    """Full UTM query string for a store (memoized; there are only a few stores)"""
+    return f"{_UTM_PREFIX}&utm_content={quote_plus(store_name.translate(_UTM_CONTENT_TABLE))}"
+
 class RealAffiliateGenerator:
     def __init__(self):
         self.db = DatabaseManager()
+        self.http_session = create_http_session()
+        self.http_session.max_redirects = MAX_VALIDATION_REDIRECTS
+        
+        # Affiliate ids read once; several are optional and absent from Config
+        self._amazon_tag = Config.AMAZON_ASSOCIATE_TAG
+        self._ebay_campaign_id = getattr(Config, 'EBAY_CAMPAIGN_ID', None)
+        self._aliexpress_tracking_id = getattr(Config, 'ALIEXPRESS_TRACKING_ID', None)
+        self._walmart_publisher_id = getattr(Config, 'WALMART_PUBLISHER_ID', None)
+        self._target_publisher_id = getattr(Config, 'TARGET_PUBLISHER_ID', None)
+        self._bestbuy_publisher_id = getattr(Config, 'BESTBUY_PUBLISHER_ID', None)
+        self._ebay_params = urlencode({'pub': self._ebay_campaign_id, **_EBAY_FIXED_PARAMS})
+        
+        # Store name tokens in match priority order
+        self._dispatch = (
+            ('amazon', self.generate_amazon_link),
+            ('ebay', self.generate_ebay_link),
+            ('aliexpress', self.generate_aliexpress_link),
+            ('walmart', self.generate_walmart_link),
+            ('target', self.generate_target_link),
+            ('bestbuy', self.generate_bestbuy_link),
+            ('best buy', self.generate_bestbuy_link)
+        )
+        # Lowercased store name -> link generator (None for generic tracking)
+        self._store_generators = {}
+    
+    def _generator_for(self, store_name: str):
+        """Resolve the link generator for a lowercased store name, memoized per name"""
+        try:
+            return self._store_generators[store_name]
+        except KeyError:
+            generator = next((fn for token, fn in self._dispatch if token in store_name), None)
+            self._store_generators[store_name] = generator
+            return generator
         
     def generate_affiliate_link(self, product_url: str, store_name: str, product_id: str = None) -> str:
         """Generate real affiliate link based on store"""
         store_name = store_name.lower()
         
         try:
-            if 'amazon' in store_name:
-                return self.generate_amazon_link(product_url, product_id)
-            elif 'ebay' in store_name:
-                return self.generate_ebay_link(product_url, product_id)
-            elif 'aliexpress' in store_name:
-                return self.generate_aliexpress_link(product_url, product_id)
-            elif 'walmart' in store_name:
-                return self.generate_walmart_link(product_url, product_id)
-            elif 'target' in store_name:
-                return self.generate_target_link(product_url, product_id)
-            elif 'bestbuy' in store_name or 'best buy' in store_name:
-                return self.generate_bestbuy_link(product_url, product_id)
-            else:
-                return self.generate_generic_tracking_link(product_url, store_name)
+            generator = self._generator_for(store_name)
+            if generator:
+                return generator(product_url, product_id)
+            return self.generate_generic_tracking_link(product_url, store_name)
                 
         except Exception as e:
-            logger.error(f"Error generating affiliate link for {store_name}: {e}")
+            logger.error("Error generating affiliate link for %s: %s", store_name, e)
             return product_url
     
     def generate_amazon_link(self, product_url: str, product_id: str = None) -> str:
         """Generate Amazon Associates affiliate link"""
-        if not Config.AMAZON_ASSOCIATE_TAG:
+        if not self._amazon_tag:
             logger.warning("Amazon Associate Tag not configured")
             return product_url
         
@@ -56,148 +175,151 @@ class RealAffiliateGenerator:
         
         if asin:
             # Clean affiliate link format
-            affiliate_url = f"https://www.amazon.com/dp/{asin}?tag={Config.AMAZON_ASSOCIATE_TAG}&linkCode=ogi&th=1&psc=1"
-            logger.info(f"Generated Amazon affiliate link: {affiliate_url}")
+            affiliate_url = f"https://www.amazon.com/dp/{asin}?tag={self._amazon_tag}&linkCode=ogi&th=1&psc=1"
+            # Runs once per product during bulk refreshes; keep it out of INFO logs
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Generated Amazon affiliate link: %s", affiliate_url)
             return affiliate_url
         else:
             # Add tag to existing URL
-            separator = "&" if "?" in product_url else "?"
-            return f"{product_url}{separator}tag={Config.AMAZON_ASSOCIATE_TAG}"
+            separator = _query_separator(product_url)
+            return f"{product_url}{separator}tag={self._amazon_tag}"
     
     def generate_ebay_link(self, product_url: str, product_id: str = None) -> str:
         """Generate eBay Partner Network affiliate link"""
-        if not hasattr(Config, 'EBAY_CAMPAIGN_ID') or not Config.EBAY_CAMPAIGN_ID:
+        if not self._ebay_campaign_id:
             logger.warning("eBay Campaign ID not configured")
             return product_url
         
-        # eBay affiliate link format
-        base_url = "https://rover.ebay.com/rover/1/711-53200-19255-0/1"
-        params = {
-            'icep_ff3': '2',
-            'pub': Config.EBAY_CAMPAIGN_ID,
-            'toolid': '10001',
-            'campid': '5338452986',
-            'customid': '',
-            'icep_item': product_id or self.extract_ebay_item_id(product_url),
-            'ipn': 'psmain',
-            'icep_vectorid': '229466',
-            'kwid': '902099',
-            'mtid': '824',
-            'kw': 'lg',
-            'srcrot': '711-53200-19255-0',
-            'rvr_id': '2348474186',
-            'rvr_ts': str(int(time.time()))
-        }
-        
-        affiliate_url = f"{base_url}?{urlencode(params)}&mpre={quote(product_url)}"
-        return affiliate_url
+        # eBay affiliate link format: pre-encoded fixed params plus the per-item ones
+        item_id = product_id or self.extract_ebay_item_id(product_url)
+        return (
+            f"{_EBAY_ROVER_URL}?{self._ebay_params}"
+            f"&icep_item={quote_plus(str(item_id))}&rvr_ts={int(time.time())}"
+            f"&mpre={_quoted_url(product_url)}"
+        )
     
     def generate_aliexpress_link(self, product_url: str, product_id: str = None) -> str:
         """Generate AliExpress affiliate link"""
-        if not hasattr(Config, 'ALIEXPRESS_TRACKING_ID') or not Config.ALIEXPRESS_TRACKING_ID:
+        if not self._aliexpress_tracking_id:
             logger.warning("AliExpress Tracking ID not configured")
             return product_url
         
         # AliExpress affiliate parameters
-        separator = "&" if "?" in product_url else "?"
-        affiliate_params = f"aff_trace_key={Config.ALIEXPRESS_TRACKING_ID}&terminal_id=d4c0d3b6c8a44e6b9c8f2e1a3b5d7f9e"
+        separator = _query_separator(product_url)
+        affiliate_params = f"aff_trace_key={self._aliexpress_tracking_id}&terminal_id=d4c0d3b6c8a44e6b9c8f2e1a3b5d7f9e"
         
         return f"{product_url}{separator}{affiliate_params}"
     
     def generate_walmart_link(self, product_url: str, product_id: str = None) -> str:
         """Generate Walmart affiliate link"""
-        if not hasattr(Config, 'WALMART_PUBLISHER_ID') or not Config.WALMART_PUBLISHER_ID:
+        if not self._walmart_publisher_id:
             return product_url
         
         # Walmart Impact Radius affiliate link
         base_url = "https://goto.walmart.com/c/2003851/565706/9383"
-        separator = "&" if "?" in product_url else "?"
-        
-        return f"{base_url}?veh=aff&sourceid={Config.WALMART_PUBLISHER_ID}&u={quote(product_url)}"
+        return f"{base_url}?veh=aff&sourceid={self._walmart_publisher_id}&u={_quoted_url(product_url)}"
     
     def generate_target_link(self, product_url: str, product_id: str = None) -> str:
         """Generate Target affiliate link"""
-        if not hasattr(Config, 'TARGET_PUBLISHER_ID') or not Config.TARGET_PUBLISHER_ID:
+        if not self._target_publisher_id:
             return product_url
         
         # Target affiliate link via Impact Radius
         base_url = "https://goto.target.com/c/2003851/81938/2092"
-        return f"{base_url}?veh=aff&sourceid={Config.TARGET_PUBLISHER_ID}&u={quote(product_url)}"
+        return f"{base_url}?veh=aff&sourceid={self._target_publisher_id}&u={_quoted_url(product_url)}"
     
     def generate_bestbuy_link(self, product_url: str, product_id: str = None) -> str:
         """Generate Best Buy affiliate link"""
-        if not hasattr(Config, 'BESTBUY_PUBLISHER_ID') or not Config.BESTBUY_PUBLISHER_ID:
+        if not self._bestbuy_publisher_id:
             return product_url
         
         # Best Buy affiliate link
         base_url = "https://bestbuy.7tiv.net/c/2003851/633495/10014"
-        return f"{base_url}?veh=aff&sourceid={Config.BESTBUY_PUBLISHER_ID}&u={quote(product_url)}"
+        return f"{base_url}?veh=aff&sourceid={self._bestbuy_publisher_id}&u={_quoted_url(product_url)}"
     
-    def generate_generic_tracking_link(self, product_url: str, store_name: str) -> str:
+    @staticmethod
+    def generate_generic_tracking_link(product_url: str, store_name: str) -> str:
         """Generate generic tracking link with UTM parameters"""
-        separator = "&" if "?" in product_url else "?"
-        utm_params = {
-            'utm_source': 'telegram_bot',
-            'utm_medium': 'affiliate',
-            'utm_campaign': 'deals_bot',
-            'utm_content': store_name.lower().replace(' ', '_')
-        }
-        
-        return f"{product_url}{separator}{urlencode(utm_params)}"
+        return f"{product_url}{_query_separator(product_url)}{_utm_query(store_name)}"
     
     def extract_amazon_asin(self, url: str) -> str:
         """Extract ASIN from Amazon URL"""
-        patterns = [
-            r'/dp/([A-Z0-9]{10})',
-            r'/gp/product/([A-Z0-9]{10})',
-            r'/product/([A-Z0-9]{10})',
-            r'asin=([A-Z0-9]{10})',
-            r'/([A-Z0-9]{10})(?:[/?]|$)'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
-        return None
+        return _extract_amazon_asin(url)
     
     def extract_ebay_item_id(self, url: str) -> str:
         """Extract item ID from eBay URL"""
-        patterns = [
-            r'/itm/([0-9]+)',
-            r'item=([0-9]+)',
-            r'/([0-9]{12,})'
+        return _extract_ebay_item_id(url)
+    
+    def validate_affiliate_link(self, url: str) -> bool:
+        """Validate that affiliate link is working"""
+        try:
+            # Redirects beyond MAX_VALIDATION_REDIRECTS raise and count as invalid
+            response = self.http_session.head(url, timeout=10, allow_redirects=True)
+            return response.status_code == 200
+        except Exception:
+            return False
+    
+    async def validate_many(self, urls: list) -> list:
+        """Validate several affiliate links concurrently over one pooled connection set"""
+        timeout = aiohttp.ClientTimeout(total=10)
+        async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=20)) as session:
+            async def validate(url):
+                try:
+                    async with session.head(url, allow_redirects=True,
+                                            max_redirects=MAX_VALIDATION_REDIRECTS) as response:
+                        return response.status == 200
+                except Exception:
+                    return False
+            
+            return await asyncio.gather(*(validate(url) for url in urls))
+    
+    def _stale_link_filter(self):
+        """SQL condition for products whose affiliate link may need rebuilding"""
+        conditions = [
+            Product.affiliate_url.is_(None),
+            # Stored untagged, e.g. before the store's affiliate id was configured
+            Product.affiliate_url == Product.product_url
         ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
-        return None
+        if self._amazon_tag:
+            conditions.append(and_(
+                Store.name.ilike('%amazon%'),
+                ~Product.affiliate_url.like(f'%tag={self._amazon_tag}%')
+            ))
+        return or_(*conditions)
     
     def update_product_affiliate_links(self, product_id: int = None):
         """Update affiliate links for products in database"""
         session = self.db.get_session()
         try:
+            # Stream only the needed columns with the store name joined in,
+            # instead of hydrating every Product and lazy-loading its store
+            query = session.query(
+                Product.id, Product.product_url, Product.affiliate_url, Store.name
+            ).join(Product.store)
             if product_id:
-                products = session.query(Product).filter(Product.id == product_id).all()
+                query = query.filter(Product.id == product_id)
             else:
-                products = session.query(Product).all()
+                query = query.filter(self._stale_link_filter())
             
-            updated_count = 0
-            for product in products:
-                if product.original_url and product.store:
+            changed = []
+            for pid, product_url, affiliate_url, store_name in query.yield_per(500):
+                if product_url:
                     new_affiliate_url = self.generate_affiliate_link(
-                        product.original_url, 
-                        product.store.name,
-                        str(product.id)
+                        product_url, 
+                        store_name,
+                        str(pid)
                     )
                     
-                    if new_affiliate_url != product.affiliate_url:
-                        product.affiliate_url = new_affiliate_url
-                        updated_count += 1
+                    if new_affiliate_url != affiliate_url:
+                        changed.append({'id': pid, 'affiliate_url': new_affiliate_url})
             
+            # Write all changed links in one executemany UPDATE keyed by id
+            if changed:
+                session.execute(update(Product), changed)
             session.commit()
+            
+            updated_count = len(changed)
             logger.info(f"Updated affiliate links for {updated_count} products")
             return updated_count
             
@@ -213,6 +335,7 @@ class AffiliateNetworkIntegration:
     
     def __init__(self):
         self.db = DatabaseManager()
+        self.http_session = create_http_session()
     
     def search_amazon_products(self, keywords: str, category: str = None) -> list:
         """Search Amazon products using Product Advertising API"""
@@ -272,7 +395,7 @@ class AffiliateNetworkIntegration:
                 'limit': 50
             }
             
-            response = requests.get(url, headers=headers, params=params)
+            response = self.http_session.get(url, headers=headers, params=params)
             if response.status_code == 200:
                 return response.json().get('products', [])
             else:
@@ -3,110 +3,264 @@
 User analytics and click tracking system
 """
 
+import atexit
 import logging
+import queue
+import threading
+import time
+from collections import Counter
 from datetime import datetime, timedelta
-from database import DatabaseManager, Product, User, ClickTracking
-from sqlalchemy import func, and_, or_
+from config import Config
+from database import DatabaseManager, Product, User, ClickTracking, ClickStatsDaily, click_rollup_params, click_rollup_upsert
+from sqlalchemy import create_engine, select, bindparam, func, case
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
 import json
 
+# Metadata is serialized on the caller's thread; use orjson's C encoder when
+# it is installed and fall back to the standard library otherwise
+try:
+    import orjson
+    
+    def _dump_json(value):
+        return orjson.dumps(value).decode()
+except ImportError:
+    _dump_json = json.dumps
+
 logger = logging.getLogger(__name__)
 
+# Tracked clicks are buffered and written in batches of up to
+# CLICK_FLUSH_BATCH rows, at most CLICK_FLUSH_INTERVAL seconds apart
+CLICK_FLUSH_BATCH = 500
+CLICK_FLUSH_INTERVAL = 0.5
+
+# Global stats are identical for every caller, so reuse them for this long
+GLOBAL_STATS_CACHE_TTL = 60
+
+# Click INSERT built once; executed with a list of rows as one executemany
+_INSERT_CLICKS = ClickTracking.__table__.insert()
+
+# Separate engine and pool for the get_* reads, so long analytic scans don't
+# hold connections needed by the click writer; points at a replica if set.
+# The reads are read-only aggregates, so the engine runs in autocommit mode
+# and skips the BEGIN/COMMIT round-trip and open snapshot per query
+_read_sessionmaker = None
+
+def _get_read_sessionmaker():
+    """Return the process-wide sessionmaker bound to the analytics read engine"""
+    global _read_sessionmaker
+    if _read_sessionmaker is None:
+        engine_options = {'pool_pre_ping': True, 'isolation_level': 'AUTOCOMMIT'}
+        if not Config.DATABASE_READ_URL.startswith('sqlite'):
+            engine_options['pool_size'] = Config.DB_READ_POOL_SIZE
+        _read_sessionmaker = sessionmaker(bind=create_engine(Config.DATABASE_READ_URL, **engine_options))
+    return _read_sessionmaker
+
+# (timestamp, stats dict) from the last successful get_global_stats
+_global_stats_cache = None
+
+# Number of days reported in daily_activity
+DAILY_ACTIVITY_DAYS = 7
+
+# Per-user and per-product read statements, built once so SQLAlchemy's
+# compiled cache reuses them; values are passed as bound parameters
+_Q_USER_CLICK_TOTALS = select(
+    func.count(),
+    func.count(case((ClickTracking.clicked_at >= bindparam('since'), 1)))
+).where(ClickTracking.user_id == bindparam('user_id'))
+
+_Q_USER_PAIR_CLICKS = select(
+    Product.category_id,
+    Product.store_id,
+    func.count()
+).join(
+    ClickTracking, Product.id == ClickTracking.product_id
+).where(
+    ClickTracking.user_id == bindparam('user_id')
+).group_by(Product.category_id, Product.store_id)
+
+def _product_click_totals(unique_users):
+    """Build the per-product totals query around a unique-users expression"""
+    return select(
+        func.count(),
+        unique_users,
+        func.count(case((ClickTracking.clicked_at >= bindparam('since'), 1)))
+    ).where(ClickTracking.product_id == bindparam('product_id'))
+
+_Q_PRODUCT_CLICK_TOTALS = _product_click_totals(
+    func.count(func.distinct(ClickTracking.user_id))
+)
+# HyperLogLog estimate (~1% error) from the postgresql-hll extension
+_Q_PRODUCT_CLICK_TOTALS_APPROX = _product_click_totals(
+    func.round(func.hll_cardinality(func.hll_add_agg(func.hll_hash_integer(ClickTracking.user_id))))
+)
+
+_Q_PRODUCT_CLICK_TYPES = select(
+    ClickTracking.click_type,
+    func.count()
+).where(
+    ClickTracking.product_id == bindparam('product_id')
+).group_by(ClickTracking.click_type)
+
 class AnalyticsManager:
     def __init__(self):
         self.db = DatabaseManager()
+        self.ReadSession = _get_read_sessionmaker()
+        
+        # Pending ClickTracking rows, drained by a background writer thread
+        self._pending_clicks = queue.Queue()
+        self._flush_lock = threading.Lock()
+        threading.Thread(target=self._flush_loop, name="click-flusher", daemon=True).start()
+        atexit.register(self.flush)
     
     def track_click(self, user_id, product_id, click_type='affiliate_link'):
-        """Track user click on product"""
-        session = self.db.get_session()
-        
-        try:
-            click = ClickTracking(
-                user_id=user_id,
-                product_id=product_id,
-                click_type=click_type,
-                clicked_at=datetime.utcnow()
-            )
-            session.add(click)
-            session.commit()
-            
-            logger.info(f"Tracked {click_type} click for user {user_id} on product {product_id}")
-            
-        except Exception as e:
-            logger.error(f"Error tracking click: {e}")
-            session.rollback()
-        finally:
-            session.close()
+        """Track user click on product (user_id is the Telegram user id)"""
+        self._pending_clicks.put({
+            'telegram_id': user_id,
+            'product_id': product_id,
+            'click_type': click_type,
+            'clicked_at': datetime.utcnow()
+        })
+        logger.info(f"Tracked {click_type} click for user {user_id} on product {product_id}")
     
     def track_user_action(self, user_id, action, metadata=None):
-        """Track general user actions"""
-        session = self.db.get_session()
+        """Track general user actions by Telegram user id (metadata may be a dict or an already-serialized JSON string)"""
+        if metadata and not isinstance(metadata, str):
+            metadata = _dump_json(metadata)
         
-        try:
-            # Store in click tracking with special action type
-            click = ClickTracking(
-                user_id=user_id,
-                product_id=None,
-                click_type=f"action_{action}",
-                clicked_at=datetime.utcnow(),
-                metadata=json.dumps(metadata) if metadata else None
-            )
-            session.add(click)
-            session.commit()
-            
-            logger.debug(f"Tracked action '{action}' for user {user_id}")
-            
-        except Exception as e:
-            logger.error(f"Error tracking action: {e}")
-            session.rollback()
-        finally:
-            session.close()
+        # Store in click tracking with special action type
+        self._pending_clicks.put({
+            'telegram_id': user_id,
+            'product_id': None,
+            'click_type': f"action_{action}",
+            'clicked_at': datetime.utcnow(),
+            'action_metadata': metadata or None
+        })
+        logger.debug(f"Tracked action '{action}' for user {user_id}")
+    
+    def _flush_loop(self):
+        """Background writer: wait for a click, then collect a batch and insert it"""
+        while True:
+            rows = [self._pending_clicks.get()]
+            deadline = time.monotonic() + CLICK_FLUSH_INTERVAL
+            while len(rows) < CLICK_FLUSH_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self._pending_clicks.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write_clicks(rows)
+    
+    @staticmethod
+    def _click_values(session, rows):
+        """Build ClickTracking insert values, mapping Telegram ids to users.id (NULL if unknown)"""
+        telegram_ids = {row['telegram_id'] for row in rows if row.get('telegram_id') is not None}
+        user_ids = dict(session.execute(
+            select(User.telegram_id, User.id).where(User.telegram_id.in_(telegram_ids))
+        ).all()) if telegram_ids else {}
+        
+        return [
+            {
+                'user_id': user_ids.get(row.get('telegram_id')),
+                'product_id': row['product_id'],
+                'click_type': row['click_type'],
+                'clicked_at': row['clicked_at'],
+                'metadata': row.get('action_metadata')
+            }
+            for row in rows
+        ]
+    
+    def _write_click_rows(self, rows):
+        """Insert click rows and their rollup totals in one transaction"""
+        with self.db.session_scope() as session:
+            session.execute(_INSERT_CLICKS, self._click_values(session, rows))
+            self._update_daily_rollup(session, rows)
+    
+    def _write_clicks(self, rows):
+        """Insert a batch of click rows with one executemany and a single commit"""
+        with self._flush_lock:
+            try:
+                self._write_click_rows(rows)
+            except IntegrityError as e:
+                # Keep the good rows of a batch that one bad row rejected
+                logger.warning(f"Batch of {len(rows)} tracked clicks rejected, retrying row by row: {e}")
+                for row in rows:
+                    try:
+                        self._write_click_rows([row])
+                    except Exception as row_error:
+                        logger.error(f"Dropping tracked click {row}: {row_error}")
+            except Exception as e:
+                logger.error(f"Error writing {len(rows)} tracked clicks: {e}")
+    
+    @staticmethod
+    def _daily_activity(session, today):
+        """Product clicks per day over the last DAILY_ACTIVITY_DAYS days, newest first"""
+        days = [(today - timedelta(days=i)).date() for i in range(DAILY_ACTIVITY_DAYS)]
+        
+        # Summed from the rollup, which every click writer maintains
+        day_counts = dict(session.execute(
+            select(ClickStatsDaily.date, func.sum(ClickStatsDaily.clicks)).where(
+                ClickStatsDaily.date >= days[-1]
+            ).group_by(ClickStatsDaily.date)
+        ).all())
+        
+        return [{'date': day.strftime('%Y-%m-%d'), 'clicks': day_counts.get(day, 0)} for day in days]
+    
+    @staticmethod
+    def _update_daily_rollup(session, rows):
+        """Add a batch of product clicks to the per-day ClickStatsDaily totals"""
+        params = click_rollup_params((row['clicked_at'], row.get('product_id')) for row in rows)
+        if not params:
+            return
+        
+        upsert = click_rollup_upsert(session.get_bind().dialect.name)
+        if upsert is None:
+            logger.warning("Click rollup skipped: no upsert support for this database")
+            return
+        session.execute(upsert, params)
+    
+    def flush(self):
+        """Write all buffered clicks now (call before shutdown or when reading fresh stats)"""
+        rows = []
+        while True:
+            try:
+                rows.append(self._pending_clicks.get_nowait())
+            except queue.Empty:
+                break
+            if len(rows) >= CLICK_FLUSH_BATCH:
+                self._write_clicks(rows)
+                rows = []
+        if rows:
+            self._write_clicks(rows)
     
     def get_user_stats(self, user_id):
         """Get analytics for a specific user"""
-        session = self.db.get_session()
+        session = self.ReadSession()
         
         try:
-            # Get user's click history
-            total_clicks = session.query(ClickTracking).filter_by(user_id=user_id).count()
-            
-            # Clicks in last 30 days
+            # User's click history: all-time and last 30 days in one pass
             thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-            recent_clicks = session.query(ClickTracking).filter(
-                and_(
-                    ClickTracking.user_id == user_id,
-                    ClickTracking.clicked_at >= thirty_days_ago
-                )
-            ).count()
+            total_clicks, recent_clicks = session.execute(
+                _Q_USER_CLICK_TOTALS, {'user_id': user_id, 'since': thirty_days_ago}
+            ).one()
             
-            # Most clicked categories
-            category_clicks = session.query(
-                Product.category_id,
-                func.count(ClickTracking.id).label('click_count')
-            ).join(
-                ClickTracking, Product.id == ClickTracking.product_id
-            ).filter(
-                ClickTracking.user_id == user_id
-            ).group_by(Product.category_id).order_by(
-                func.count(ClickTracking.id).desc()
-            ).limit(5).all()
+            # Clicks per (category, store) pair, rolled up per dimension below
+            pair_clicks = session.execute(_Q_USER_PAIR_CLICKS, {'user_id': user_id})
             
-            # Most clicked stores
-            store_clicks = session.query(
-                Product.store_id,
-                func.count(ClickTracking.id).label('click_count')
-            ).join(
-                ClickTracking, Product.id == ClickTracking.product_id
-            ).filter(
-                ClickTracking.user_id == user_id
-            ).group_by(Product.store_id).order_by(
-                func.count(ClickTracking.id).desc()
-            ).limit(5).all()
+            category_clicks = Counter()
+            store_clicks = Counter()
+            for category_id, store_id, clicks in pair_clicks:
+                category_clicks[category_id] += clicks
+                store_clicks[store_id] += clicks
             
             return {
                 'total_clicks': total_clicks,
                 'recent_clicks': recent_clicks,
-                'top_categories': category_clicks,
-                'top_stores': store_clicks
+                # Most clicked categories and stores as (id, click_count) pairs
+                'top_categories': category_clicks.most_common(5),
+                'top_stores': store_clicks.most_common(5)
             }
             
         except Exception as e:
@@ -117,33 +271,21 @@ class AnalyticsManager:
     
     def get_product_stats(self, product_id):
         """Get analytics for a specific product"""
-        session = self.db.get_session()
+        session = self.ReadSession()
         
         try:
-            # Total clicks
-            total_clicks = session.query(ClickTracking).filter_by(product_id=product_id).count()
-            
-            # Unique users who clicked
-            unique_users = session.query(ClickTracking.user_id).filter_by(
-                product_id=product_id
-            ).distinct().count()
+            # Total clicks, unique users who clicked and recent activity (last 7 days)
+            week_ago = datetime.utcnow() - timedelta(days=7)
+            approximate = (Config.ANALYTICS_APPROX_DISTINCT
+                           and session.get_bind().dialect.name == 'postgresql')
+            total_clicks, unique_users, recent_clicks = session.execute(
+                _Q_PRODUCT_CLICK_TOTALS_APPROX if approximate else _Q_PRODUCT_CLICK_TOTALS,
+                {'product_id': product_id, 'since': week_ago}
+            ).one()
+            unique_users = int(unique_users or 0)
             
             # Clicks by type
-            click_types = session.query(
-                ClickTracking.click_type,
-                func.count(ClickTracking.id).label('count')
-            ).filter_by(product_id=product_id).group_by(
-                ClickTracking.click_type
-            ).all()
-            
-            # Recent activity (last 7 days)
-            week_ago = datetime.utcnow() - timedelta(days=7)
-            recent_clicks = session.query(ClickTracking).filter(
-                and_(
-                    ClickTracking.product_id == product_id,
-                    ClickTracking.clicked_at >= week_ago
-                )
-            ).count()
+            click_types = session.execute(_Q_PRODUCT_CLICK_TYPES, {'product_id': product_id}).all()
             
             return {
                 'total_clicks': total_clicks,
@@ -159,60 +301,63 @@ class AnalyticsManager:
             session.close()
     
     def get_global_stats(self):
-        """Get global analytics"""
-        session = self.db.get_session()
+        """Get global analytics, reusing recent results within GLOBAL_STATS_CACHE_TTL"""
+        global _global_stats_cache
+        now = time.monotonic()
+        if _global_stats_cache and now - _global_stats_cache[0] < GLOBAL_STATS_CACHE_TTL:
+            return _global_stats_cache[1]
+        
+        stats = self._query_global_stats()
+        if stats:
+            _global_stats_cache = (now, stats)
+        return stats
+    
+    def _query_global_stats(self):
+        """Compute global analytics from the database"""
+        session = self.ReadSession()
         
         try:
             # Total users
-            total_users = session.query(User).count()
+            total_users = session.execute(select(func.count()).select_from(User)).scalar()
+            
+            # One clock reading shared by every time window below
+            now = datetime.utcnow()
             
             # Active users (clicked in last 30 days)
-            thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-            active_users = session.query(ClickTracking.user_id).filter(
-                ClickTracking.clicked_at >= thirty_days_ago
-            ).distinct().count()
+            thirty_days_ago = now - timedelta(days=30)
+            active_users = session.execute(
+                select(func.count(func.distinct(ClickTracking.user_id))).where(
+                    ClickTracking.clicked_at >= thirty_days_ago
+                )
+            ).scalar()
             
             # Total clicks
-            total_clicks = session.query(ClickTracking).count()
+            total_clicks = session.execute(select(func.count()).select_from(ClickTracking)).scalar()
             
-            # Most popular products (by clicks)
+            # Most popular products (by clicks), read from the daily rollup
+            product_clicks = func.sum(ClickStatsDaily.clicks)
             popular_products = session.query(
                 Product.id,
                 Product.title,
-                func.count(ClickTracking.id).label('click_count')
+                product_clicks.label('click_count')
             ).join(
-                ClickTracking, Product.id == ClickTracking.product_id
+                ClickStatsDaily, Product.id == ClickStatsDaily.product_id
             ).group_by(Product.id, Product.title).order_by(
-                func.count(ClickTracking.id).desc()
+                product_clicks.desc()
             ).limit(10).all()
             
             # Most popular categories
+            category_clicks = func.sum(ClickStatsDaily.clicks)
             popular_categories = session.query(
-                Product.category_id,
-                func.count(ClickTracking.id).label('click_count')
-            ).join(
-                ClickTracking, Product.id == ClickTracking.product_id
-            ).group_by(Product.category_id).order_by(
-                func.count(ClickTracking.id).desc()
+                ClickStatsDaily.category_id,
+                category_clicks.label('click_count')
+            ).group_by(ClickStatsDaily.category_id).order_by(
+                category_clicks.desc()
             ).limit(10).all()
             
             # Daily activity (last 7 days)
-            daily_stats = []
-            for i in range(7):
-                day_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=i)
-                day_end = day_start + timedelta(days=1)
-                
-                day_clicks = session.query(ClickTracking).filter(
-                    and_(
-                        ClickTracking.clicked_at >= day_start,
-                        ClickTracking.clicked_at < day_end
-                    )
-                ).count()
-                
-                daily_stats.append({
-                    'date': day_start.strftime('%Y-%m-%d'),
-                    'clicks': day_clicks
-                })
+            today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            daily_stats = self._daily_activity(session, today)
             
             return {
                 'total_users': total_users,
@@ -231,44 +376,49 @@ class AnalyticsManager:
     
     def track_group_post(self, group_id: int, post_type: str, product_count: int):
         """Track group post analytics"""
-        session = self.db.get_session()
-        try:
-            # Create a group action record
-            action = UserAction(
-                user_id=group_id,  # Use group_id as identifier
-                action_type=f'group_{post_type}',
-                details=f'Posted {product_count} products to group {group_id}',
-                timestamp=datetime.now()
-            )
-            session.add(action)
-            session.commit()
-            logger.info(f"Tracked group post: {post_type} to group {group_id}")
-        except Exception as e:
-            logger.error(f"Error tracking group post: {e}")
-            session.rollback()
-        finally:
-            session.close()
+        # Stored alongside clicks; the group isn't a user, so it goes in the metadata
+        self._pending_clicks.put({
+            'telegram_id': None,
+            'product_id': None,
+            'click_type': f'group_{post_type}',
+            'clicked_at': datetime.utcnow(),
+            'action_metadata': _dump_json({'group_id': group_id, 'product_count': product_count})
+        })
+        logger.info(f"Tracked group post: {post_type} to group {group_id}")
     
-    def get_conversion_metrics(self):
-        """Get conversion and engagement metrics"""
-        session = self.db.get_session()
+    def get_conversion_metrics(self, days=90):
+        """Get conversion and engagement metrics for clicks in the last `days` days"""
+        session = self.ReadSession()
         
         try:
+            since = datetime.utcnow() - timedelta(days=days)
+            
             # Click-through rates by category
             category_metrics = session.query(
                 Product.category_id,
-                func.count(ClickTracking.id).label('total_clicks'),
+                func.count().label('total_clicks'),
                 func.count(func.distinct(ClickTracking.user_id)).label('unique_users')
             ).join(
                 ClickTracking, Product.id == ClickTracking.product_id
+            ).filter(
+                ClickTracking.clicked_at >= since
             ).group_by(Product.category_id).all()
             
-            # User engagement levels
-            user_engagement = session.query(
-                ClickTracking.user_id,
-                func.count(ClickTracking.id).label('total_clicks'),
-                func.max(ClickTracking.clicked_at).label('last_activity')
-            ).group_by(ClickTracking.user_id).all()
+            # User engagement levels, bucketed in the database
+            user_clicks = session.query(
+                func.count().label('total_clicks')
+            ).filter(
+                ClickTracking.clicked_at >= since
+            ).group_by(ClickTracking.user_id).subquery()
+            
+            level = case(
+                (user_clicks.c.total_clicks >= 10, 'high'),
+                (user_clicks.c.total_clicks >= 3, 'medium'),
+                else_='low'
+            ).label('level')
+            level_counts = session.query(level, func.count()).select_from(
+                user_clicks
+            ).group_by(level).all()
             
             # Engagement categories
             engagement_levels = {
@@ -276,20 +426,12 @@ class AnalyticsManager:
                 'medium': 0,  # 3-9 clicks
                 'low': 0      # 1-2 clicks
             }
-            
-            for user_data in user_engagement:
-                clicks = user_data.total_clicks
-                if clicks >= 10:
-                    engagement_levels['high'] += 1
-                elif clicks >= 3:
-                    engagement_levels['medium'] += 1
-                else:
-                    engagement_levels['low'] += 1
+            engagement_levels.update(level_counts)
             
             return {
                 'category_metrics': category_metrics,
                 'engagement_levels': engagement_levels,
-                'total_engaged_users': len(user_engagement)
+                'total_engaged_users': sum(engagement_levels.values())
             }
             
         except Exception as e:
@@ -329,6 +471,7 @@ if __name__ == "__main__":
     # Test tracking
     analytics.track_click(12345, 1, 'affiliate_link')
     analytics.track_user_action(12345, 'search', {'query': 'iPhone'})
+    analytics.flush()
     
     # Get stats
     global_stats = analytics.get_global_stats()
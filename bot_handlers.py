@@ -1,9 +1,15 @@
+import asyncio
 import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import ContextTypes
-from database import DatabaseManager, Product, Category, Store, User, ClickTracking
-from affiliate_manager import AffiliateManager
-from sqlalchemy import and_, or_
+from database import DatabaseManager, Product, Category, Store, User, ClickTracking, click_rollup_params, click_rollup_upsert
+from sqlalchemy import select, insert, update, bindparam, and_, or_
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
 from datetime import datetime, timedelta
 import json
 
@@ -11,11 +17,219 @@ import json
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Product clicks are queued and inserted in batches of up to CLICK_FLUSH_BATCH
+# rows, at most CLICK_FLUSH_INTERVAL seconds apart
+CLICK_FLUSH_BATCH = 500
+CLICK_FLUSH_INTERVAL = 0.2
+
+# Most recently seen users whose users.id is kept in memory
+USER_ID_CACHE_SIZE = 10000
+
+# Categories rarely change, so the list is reused for this long
+CATEGORIES_CACHE_TTL = 300
+
+# Today's deals are shared by /start, /deals and the deals screen, refreshed this often
+DEALS_CACHE_TTL = 60
+DEALS_CACHE_SIZE = 10
+
+def _shorten(text, limit):
+    """Cut text to limit characters, marking the cut with '...'"""
+    return text if len(text) <= limit else text[:limit] + '...'
+
+def _render_deals_message(deals):
+    """Render the /deals reply as (text, reply_markup)"""
+    parts = ["🔥 **Today's Hot Deals** 🔥\n\n"]
+    keyboard = []
+    
+    for i, product in enumerate(deals[:10], 1):
+        discount_text = f" (-{product.discount_percentage:.0f}%)" if product.discount_percentage else ""
+        price_text = f"${product.price:.2f}" if product.price else "Price on request"
+        store_name = product.store.name if product.store else 'Unknown Store'
+        
+        parts.append(f"{i}. **{product.title}**\n💰 {price_text}{discount_text}\n🏪 {store_name}\n\n")
+        
+        keyboard.append([InlineKeyboardButton(f"🛒 View Deal {i}", callback_data=f"product_{product.id}")])
+    
+    keyboard.append([InlineKeyboardButton("🔄 Refresh Deals", callback_data="daily_deals")])
+    keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu")])
+    
+    return "".join(parts), InlineKeyboardMarkup(keyboard)
+
+def _render_deals_screen(deals):
+    """Render the daily deals menu screen as (text, reply_markup)"""
+    parts = ["🔥 **Today's Hot Deals** 🔥\n\n"]
+    keyboard = []
+    
+    for i, product in enumerate(deals[:8], 1):
+        discount_text = f" (-{product.discount_percentage:.0f}%)" if product.discount_percentage else ""
+        price_text = f"${product.price:.2f}" if product.price else "Check Price"
+        store_name = product.store.name if product.store else 'Multiple Stores'
+        
+        parts.append(f"{i}. **{_shorten(product.title, 50)}**\n💰 {price_text}{discount_text}\n🏪 {store_name}\n\n")
+        
+        keyboard.append([InlineKeyboardButton(f"🛒 View Deal {i}", callback_data=f"product_{product.id}")])
+    
+    keyboard.append([InlineKeyboardButton("🔄 Refresh", callback_data="daily_deals")])
+    keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu")])
+    
+    return "".join(parts), InlineKeyboardMarkup(keyboard)
+
+def _render_deals_preview(deals):
+    """Render the top 3 deals as a preview block for chat messages"""
+    parts = []
+    for i, product in enumerate(deals[:3], 1):
+        discount_text = f" (-{product.discount_percentage:.0f}%)" if product.discount_percentage else ""
+        price_text = f"${product.price:.2f}" if product.price else "Check Price"
+        store_name = product.store.name if product.store else 'Store'
+        
+        parts.append(f"{i}. **{_shorten(product.title, 35)}**\n   💰 {price_text}{discount_text} | 🏪 {store_name}\n")
+    
+    parts.append("\n👆 *Tap 'Open Deals App' to see all deals!*")
+    return "".join(parts)
+
+# Dialect-specific INSERT constructs supporting ON CONFLICT upserts
+_UPSERT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+# Static screen texts
+HELP_TEXT_TEMPLATE = """
+🤖 **Affiliate Deals Bot Help**
+
+**Commands:**
+/start - Start the bot and see main menu
+/deals - View today's hot deals
+/categories - Browse products by category
+/search <query> - Search for specific products
+/settings - Manage your preferences
+/help - Show this help message
+
+**How to use:**
+1️⃣ Browse categories or search for products
+2️⃣ Click on products to see details
+3️⃣ Use affiliate links to purchase and support us
+4️⃣ Set preferences for personalized deals
+
+**Categories:**
+{categories}
+
+**Features:**
+• Real-time price tracking
+• Daily deal notifications
+• Multi-store comparison
+• Personalized recommendations
+• Discount alerts
+
+Need more help? Contact @YourSupportUsername
+"""
+
+SEARCH_TEXT = (
+    "🔍 **Search Products**\n\n"
+    "To search for products, use the command:\n"
+    "`/search <product name>`\n\n"
+    "**Examples:**\n"
+    "• `/search iPhone`\n"
+    "• `/search Nike shoes`\n"
+    "• `/search laptop`\n"
+    "• `/search skincare`\n\n"
+    "I'll find the best deals matching your search!"
+)
+
+SETTINGS_TEXT = (
+    "⚙️ **Settings**\n\n"
+    "Manage your preferences and notifications:"
+)
+
+PRICE_ALERTS_TEXT = (
+    "💰 **Price Alert Settings**\n\n"
+    "Get notified when products drop to your target price!\n\n"
+    "**Features:**\n"
+    "• Set custom price targets\n"
+    "• Automatic price monitoring\n"
+    "• Instant notifications\n\n"
+    "*Note: Price alerts are currently in development*"
+)
+
+# Static keyboards, built once and shared by every request
+MAIN_MENU_ROWS = [
+    [InlineKeyboardButton("🔥 Daily Deals", callback_data="daily_deals")],
+    [InlineKeyboardButton("📱 Electronics", callback_data="electronics"),
+     InlineKeyboardButton("👔 Clothing", callback_data="clothing")],
+    [InlineKeyboardButton("💄 Beauty", callback_data="beauty"),
+     InlineKeyboardButton("🏠 Household", callback_data="household")],
+    [InlineKeyboardButton("🔍 Search Products", callback_data="search")],
+    [InlineKeyboardButton("⚙️ Settings", callback_data="settings")]
+]
+MAIN_MENU_MARKUP = InlineKeyboardMarkup(MAIN_MENU_ROWS)
+
+CLOTHING_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("👔 Men's Clothing", callback_data="category_mens_clothing")],
+    [InlineKeyboardButton("👗 Women's Clothing", callback_data="category_womens_clothing")],
+    [InlineKeyboardButton("👟 Shoes", callback_data="category_shoes")],
+    [InlineKeyboardButton("👜 Accessories", callback_data="category_accessories")],
+    [InlineKeyboardButton("🔙 Back to Categories", callback_data="main_menu")]
+])
+
+SEARCH_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu")]
+])
+
+SETTINGS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔔 Notifications", callback_data="settings_notifications")],
+    [InlineKeyboardButton("💰 Price Alerts", callback_data="settings_price_alerts")],
+    [InlineKeyboardButton("📂 Preferred Categories", callback_data="settings_categories")],
+    [InlineKeyboardButton("🔙 Back to Main Menu", callback_data="main_menu")]
+])
+
+PRICE_ALERTS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔔 Set Price Alert", callback_data="create_price_alert")],
+    [InlineKeyboardButton("📋 My Alerts", callback_data="view_price_alerts")],
+    [InlineKeyboardButton("🔙 Back to Settings", callback_data="settings")]
+])
+
+# Handler statements built once; per-request values are bound parameters, so
+# every call reuses the same compiled SQL from the engine's statement cache
+_CATEGORY_PRODUCTS_STMT = select(Product).options(selectinload(Product.store)).where(
+    and_(Product.category_id == bindparam('category_id'), Product.is_active == True)
+).limit(8)
+
+_PRODUCT_DETAILS_STMT = select(Product).options(
+    joinedload(Product.store), joinedload(Product.category)
+).where(Product.id == bindparam('product_id'))
+
+# Search in title and description; bind pattern as '%<query>%'
+_SEARCH_PRODUCTS_STMT = select(Product).options(selectinload(Product.store)).where(
+    and_(
+        or_(
+            Product.title.ilike(bindparam('pattern')),
+            Product.description.ilike(bindparam('pattern'))
+        ),
+        Product.is_active == True
+    )
+).limit(10)
+
+@dataclass(frozen=True)
+class CategoryDTO:
+    """Plain copy of a Category row, safe to share across sessions"""
+    id: int
+    name: str
+    display_name: str
+    emoji: str
+
 class BotHandlers:
     def __init__(self, mini_app=None):
         self.db = DatabaseManager()
-        self.affiliate_manager = AffiliateManager()
         self.mini_app = mini_app
+        self._click_queue = asyncio.Queue()  # (telegram_user_id, product_id, clicked_at)
+        self._click_flusher = None  # background task draining _click_queue, started on first click
+        self._user_ids = OrderedDict()  # telegram_id -> users.id LRU, filled by register_user and click batches
+        self._chat_tasks = {}  # chat_id -> latest callback task (strong ref, keeps per-chat order)
+        self._cat_cache = (0.0, [])  # (monotonic time fetched, [CategoryDTO])
+        self._deals_cache = (0.0, None, [])  # (monotonic time fetched, date, [Product])
+        self._today = (None, 0.0)  # (today's date, monotonic time of the next midnight)
+        self._deals_rendered = (None, {})  # (deals list rendered from, {renderer: output})
+        self._main_menu_cache = (None, MAIN_MENU_MARKUP)  # (webapp_url, markup with app button)
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
@@ -23,7 +237,7 @@ class BotHandlers:
         chat_id = update.effective_chat.id
         
         # Register user in database
-        self.register_user(user)
+        await self.register_user(user)
         
         welcome_message = f"""
 🛍️ **Welcome to Affiliate Deals Bot!** 🛍️
@@ -38,7 +252,7 @@ Hello {user.first_name}! I'm your personal shopping assistant that helps you fin
 • Get notifications for new deals
 
 📱 **Categories Available:**
-{self.get_categories_text()}
+{await self.get_categories_text()}
 
 **Quick Commands:**
 /deals - View today's hot deals
@@ -50,98 +264,40 @@ Ready to start shopping? Choose an option below! 👇
         """
         
         # Add daily deals preview to welcome message
-        daily_deals_preview = self.get_daily_deals_preview()
+        daily_deals_preview = await self.get_daily_deals_preview()
         if daily_deals_preview:
             welcome_message += "\n\n🔥 **Today's Top Deals:**\n" + daily_deals_preview
         
-        keyboard = []
-        
-        # Add mini app button if available
-        if self.mini_app and self.mini_app.webapp_url:
-            keyboard.append([InlineKeyboardButton("🛍️ Open Deals App", web_app=WebAppInfo(url=self.mini_app.webapp_url))])
-        
-        keyboard.extend([
-            [InlineKeyboardButton("🔥 Daily Deals", callback_data="daily_deals")],
-            [InlineKeyboardButton("📱 Electronics", callback_data="electronics"),
-             InlineKeyboardButton("👔 Clothing", callback_data="clothing")],
-            [InlineKeyboardButton("💄 Beauty", callback_data="beauty"),
-             InlineKeyboardButton("🏠 Household", callback_data="household")],
-            [InlineKeyboardButton("🔍 Search Products", callback_data="search")],
-            [InlineKeyboardButton("⚙️ Settings", callback_data="settings")]
-        ])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = self._main_menu_markup()
         await update.message.reply_text(welcome_message, reply_markup=reply_markup, parse_mode='Markdown')
     
+    def _main_menu_markup(self):
+        """Main menu keyboard, with the mini app button while a web app URL is set"""
+        webapp_url = self.mini_app.webapp_url if self.mini_app else None
+        if not webapp_url:
+            return MAIN_MENU_MARKUP
+        
+        # The tunnel URL can change at runtime, so rebuild only when it does
+        if self._main_menu_cache[0] != webapp_url:
+            app_button = InlineKeyboardButton("🛍️ Open Deals App", web_app=WebAppInfo(url=webapp_url))
+            self._main_menu_cache = (webapp_url, InlineKeyboardMarkup([[app_button]] + MAIN_MENU_ROWS))
+        return self._main_menu_cache[1]
+    
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /help command"""
-        help_text = """
-🤖 **Affiliate Deals Bot Help**
-
-**Commands:**
-/start - Start the bot and see main menu
-/deals - View today's hot deals
-/categories - Browse products by category
-/search <query> - Search for specific products
-/settings - Manage your preferences
-/help - Show this help message
-
-**How to use:**
-1️⃣ Browse categories or search for products
-2️⃣ Click on products to see details
-3️⃣ Use affiliate links to purchase and support us
-4️⃣ Set preferences for personalized deals
-
-**Categories:**
-{self.get_categories_text()}
-
-**Features:**
-• Real-time price tracking
-• Daily deal notifications
-• Multi-store comparison
-• Personalized recommendations
-• Discount alerts
-
-Need more help? Contact @YourSupportUsername
-        """
-        
+        help_text = HELP_TEXT_TEMPLATE.format(categories=await self.get_categories_text())
         await update.message.reply_text(help_text, parse_mode='Markdown')
     
     async def deals_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /deals command - show daily deals"""
-        session = self.db.get_session()
-        
-        # Get daily deals (products marked as daily deals or created today)
-        today = datetime.now().date()
-        daily_deals = session.query(Product).filter(
-            or_(
-                Product.is_daily_deal == True,
-                Product.created_at >= today
-            )
-        ).filter(Product.is_active == True).limit(10).all()
+        daily_deals = await self._get_daily_deals()
         
         if not daily_deals:
             await update.message.reply_text("🔍 No daily deals available right now. Check back later!")
             return
         
-        message = "🔥 **Today's Hot Deals** 🔥\n\n"
-        keyboard = []
-        
-        for i, product in enumerate(daily_deals, 1):
-            discount_text = f" (-{product.discount_percentage:.0f}%)" if product.discount_percentage else ""
-            price_text = f"${product.price:.2f}" if product.price else "Price on request"
-            
-            message += f"{i}. **{product.title}**\n"
-            message += f"💰 {price_text}{discount_text}\n"
-            message += f"🏪 {product.store.name if product.store else 'Unknown Store'}\n\n"
-            
-            keyboard.append([InlineKeyboardButton(f"🛒 View Deal {i}", callback_data=f"product_{product.id}")])
-        
-        keyboard.append([InlineKeyboardButton("🔄 Refresh Deals", callback_data="daily_deals")])
-        keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+        text, reply_markup = self._rendered_deals(daily_deals, _render_deals_message)
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
     
     async def categories_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /categories command"""
@@ -172,6 +328,29 @@ Need more help? Contact @YourSupportUsername
         query = update.callback_query
         await query.answer()
         
+        # Acknowledge right away and do the (database-bound) work in a background
+        # task so the next update isn't held up; a chat's callbacks run in order
+        chat_id = query.message.chat_id if query.message else query.from_user.id
+        task = asyncio.create_task(
+            self._dispatch_callback(query, context, self._chat_tasks.get(chat_id))
+        )
+        self._chat_tasks[chat_id] = task
+        task.add_done_callback(
+            lambda done: self._chat_tasks.pop(chat_id) if self._chat_tasks.get(chat_id) is done else None
+        )
+    
+    async def _dispatch_callback(self, query, context, previous):
+        """Route a button callback once the chat's previous callback has finished"""
+        if previous:
+            await asyncio.wait({previous})
+        
+        try:
+            await self._route_callback(query, context)
+        except Exception as e:
+            logger.error(f"Error handling callback {query.data!r}: {e}")
+    
+    async def _route_callback(self, query, context):
+        """Call the screen handler for a button's callback data"""
         data = query.data
         
         if data == "main_menu":
@@ -197,23 +376,7 @@ Need more help? Contact @YourSupportUsername
     
     async def show_main_menu(self, query, context):
         """Show main menu"""
-        keyboard = []
-        
-        # Add mini app button if available
-        if self.mini_app and self.mini_app.webapp_url:
-            keyboard.append([InlineKeyboardButton("🛍️ Open Deals App", web_app=WebAppInfo(url=self.mini_app.webapp_url))])
-        
-        keyboard.extend([
-            [InlineKeyboardButton("🔥 Daily Deals", callback_data="daily_deals")],
-            [InlineKeyboardButton("📱 Electronics", callback_data="electronics"),
-             InlineKeyboardButton("👔 Clothing", callback_data="clothing")],
-            [InlineKeyboardButton("💄 Beauty", callback_data="beauty"),
-             InlineKeyboardButton("🏠 Household", callback_data="household")],
-            [InlineKeyboardButton("🔍 Search Products", callback_data="search")],
-            [InlineKeyboardButton("⚙️ Settings", callback_data="settings")]
-        ])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = self._main_menu_markup()
         await query.edit_message_text(
             "🛍️ **Affiliate Deals Bot - Main Menu**\n\n"
             "Choose a category to browse products or search for specific items:",
@@ -223,8 +386,7 @@ Need more help? Contact @YourSupportUsername
     
     async def show_categories(self, update, context):
         """Show all categories"""
-        session = self.db.get_session()
-        categories = session.query(Category).all()
+        categories = await self._get_categories()
         
         keyboard = []
         for category in categories:
@@ -243,68 +405,34 @@ Need more help? Contact @YourSupportUsername
     
     async def show_clothing_subcategories(self, query, context):
         """Show clothing subcategories"""
-        keyboard = [
-            [InlineKeyboardButton("👔 Men's Clothing", callback_data="category_mens_clothing")],
-            [InlineKeyboardButton("👗 Women's Clothing", callback_data="category_womens_clothing")],
-            [InlineKeyboardButton("👟 Shoes", callback_data="category_shoes")],
-            [InlineKeyboardButton("👜 Accessories", callback_data="category_accessories")],
-            [InlineKeyboardButton("🔙 Back to Categories", callback_data="main_menu")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text(
             "👕 **Clothing Categories**\n\nChoose a clothing category:",
-            reply_markup=reply_markup,
+            reply_markup=CLOTHING_MARKUP,
             parse_mode='Markdown'
         )
     
     async def show_daily_deals(self, query, context):
         """Show daily deals"""
-        session = self.db.get_session()
-        
-        today = datetime.now().date()
-        daily_deals = session.query(Product).filter(
-            or_(
-                Product.is_daily_deal == True,
-                Product.created_at >= today
-            )
-        ).filter(Product.is_active == True).limit(8).all()
+        daily_deals = await self._get_daily_deals()
         
         if not daily_deals:
             await query.edit_message_text("🔍 No daily deals available right now. Check back later!")
             return
         
-        message = "🔥 **Today's Hot Deals** 🔥\n\n"
-        keyboard = []
-        
-        for i, product in enumerate(daily_deals, 1):
-            discount_text = f" (-{product.discount_percentage:.0f}%)" if product.discount_percentage else ""
-            price_text = f"${product.price:.2f}" if product.price else "Check Price"
-            
-            message += f"{i}. **{product.title[:50]}{'...' if len(product.title) > 50 else ''}**\n"
-            message += f"💰 {price_text}{discount_text}\n"
-            message += f"🏪 {product.store.name if product.store else 'Multiple Stores'}\n\n"
-            
-            keyboard.append([InlineKeyboardButton(f"🛒 View Deal {i}", callback_data=f"product_{product.id}")])
-        
-        keyboard.append([InlineKeyboardButton("🔄 Refresh", callback_data="daily_deals")])
-        keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+        text, reply_markup = self._rendered_deals(daily_deals, _render_deals_screen)
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
     
     async def show_category_products(self, query, context, category_name):
         """Show products in a specific category"""
-        session = self.db.get_session()
-        
-        category = session.query(Category).filter_by(name=category_name).first()
+        category = next((c for c in await self._get_categories() if c.name == category_name), None)
         if not category:
             await query.edit_message_text("❌ Category not found!")
             return
         
-        products = session.query(Product).filter(
-            and_(Product.category_id == category.id, Product.is_active == True)
-        ).limit(8).all()
+        async with self.db.async_session_scope() as session:
+            products = (await session.execute(
+                _CATEGORY_PRODUCTS_STMT, {'category_id': category.id}
+            )).scalars().all()
         
         if not products:
             keyboard = [[InlineKeyboardButton("🔙 Back to Categories", callback_data="main_menu")]]
@@ -317,28 +445,27 @@ Need more help? Contact @YourSupportUsername
             )
             return
         
-        message = f"{category.emoji} **{category.display_name}**\n\n"
+        parts = [f"{category.emoji} **{category.display_name}**\n\n"]
         keyboard = []
         
         for i, product in enumerate(products, 1):
             price_text = f"${product.price:.2f}" if product.price else "Check Price"
             discount_text = f" (-{product.discount_percentage:.0f}%)" if product.discount_percentage else ""
+            store_name = product.store.name if product.store else 'Multiple Stores'
             
-            message += f"{i}. **{product.title[:45]}{'...' if len(product.title) > 45 else ''}**\n"
-            message += f"💰 {price_text}{discount_text}\n"
-            message += f"🏪 {product.store.name if product.store else 'Multiple Stores'}\n\n"
+            parts.append(f"{i}. **{_shorten(product.title, 45)}**\n💰 {price_text}{discount_text}\n🏪 {store_name}\n\n")
             
             keyboard.append([InlineKeyboardButton(f"🛒 View Product {i}", callback_data=f"product_{product.id}")])
         
         keyboard.append([InlineKeyboardButton("🔙 Back to Categories", callback_data="main_menu")])
         
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text("".join(parts), reply_markup=reply_markup, parse_mode='Markdown')
     
     async def show_product_details(self, query, context, product_id):
         """Show detailed product information"""
-        session = self.db.get_session()
-        product = session.query(Product).filter_by(id=product_id).first()
+        async with self.db.async_session_scope() as session:
+            product = await session.scalar(_PRODUCT_DETAILS_STMT, {'product_id': product_id})
         
         if not product:
             await query.edit_message_text("❌ Product not found!")
@@ -374,82 +501,21 @@ Need more help? Contact @YourSupportUsername
         reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
     
-    async def search_products(self, update, context, query_text):
-        """Search for products"""
-        session = self.db.get_session()
-        
-        # Search in title and description
-        products = session.query(Product).filter(
-            and_(
-                or_(
-                    Product.title.ilike(f'%{query_text}%'),
-                    Product.description.ilike(f'%{query_text}%')
-                ),
-                Product.is_active == True
-            )
-        ).limit(8).all()
-        
-        if not products:
-            await update.message.reply_text(
-                f"🔍 No products found for **'{query_text}'**\n\n"
-                "Try searching with different keywords or browse our categories.",
-                parse_mode='Markdown'
-            )
-            return
-        
-        message = f"🔍 **Search Results for '{query_text}'**\n\n"
-        keyboard = []
-        
-        for i, product in enumerate(products, 1):
-            price_text = f"${product.price:.2f}" if product.price else "Check Price"
-            discount_text = f" (-{product.discount_percentage:.0f}%)" if product.discount_percentage else ""
-            
-            message += f"{i}. **{product.title[:45]}{'...' if len(product.title) > 45 else ''}**\n"
-            message += f"💰 {price_text}{discount_text}\n"
-            message += f"🏪 {product.store.name if product.store else 'Multiple Stores'}\n\n"
-            
-            keyboard.append([InlineKeyboardButton(f"🛒 View Product {i}", callback_data=f"product_{product.id}")])
-        
-        keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
-    
     async def show_search_interface(self, query, context):
         """Show search interface"""
-        keyboard = [
-            [InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text(
-            "🔍 **Search Products**\n\n"
-            "To search for products, use the command:\n"
-            "`/search <product name>`\n\n"
-            "**Examples:**\n"
-            "• `/search iPhone`\n"
-            "• `/search Nike shoes`\n"
-            "• `/search laptop`\n"
-            "• `/search skincare`\n\n"
-            "I'll find the best deals matching your search!",
-            reply_markup=reply_markup,
+            SEARCH_TEXT,
+            reply_markup=SEARCH_MARKUP,
             parse_mode='Markdown'
         )
     
     async def search_products(self, update, context, query_text):
         """Search for products based on query"""
-        session = self.db.get_session()
-        
         # Search in title and description
-        search_results = session.query(Product).filter(
-            and_(
-                or_(
-                    Product.title.ilike(f'%{query_text}%'),
-                    Product.description.ilike(f'%{query_text}%')
-                ),
-                Product.is_active == True
-            )
-        ).limit(10).all()
+        async with self.db.async_session_scope() as session:
+            search_results = (await session.execute(
+                _SEARCH_PRODUCTS_STMT, {'pattern': f'%{query_text}%'}
+            )).scalars().all()
         
         if not search_results:
             await update.message.reply_text(
@@ -463,45 +529,35 @@ Need more help? Contact @YourSupportUsername
             )
             return
         
-        message = f"🔍 **Search Results for '{query_text}'**\n\n"
-        message += f"Found {len(search_results)} product(s):\n\n"
+        parts = [
+            f"🔍 **Search Results for '{query_text}'**\n\n"
+            f"Found {len(search_results)} product(s):\n\n"
+        ]
         
         keyboard = []
         
         for i, product in enumerate(search_results, 1):
             discount_text = f" (-{product.discount_percentage:.0f}%)" if product.discount_percentage else ""
             price_text = f"${product.price:.2f}" if product.price else "Check Price"
+            store_name = product.store.name if product.store else 'Multiple Stores'
             
-            message += f"{i}. **{product.title[:60]}{'...' if len(product.title) > 60 else ''}**\n"
-            message += f"💰 {price_text}{discount_text}\n"
-            message += f"🏪 {product.store.name if product.store else 'Multiple Stores'}\n"
+            parts.append(f"{i}. **{_shorten(product.title, 60)}**\n💰 {price_text}{discount_text}\n🏪 {store_name}\n")
             if product.rating:
-                message += f"⭐ {product.rating}/5 ({product.review_count} reviews)\n"
-            message += "\n"
+                parts.append(f"⭐ {product.rating}/5 ({product.review_count} reviews)\n")
+            parts.append("\n")
             
             keyboard.append([InlineKeyboardButton(f"🛒 View Product {i}", callback_data=f"product_{product.id}")])
         
         keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu")])
         
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
-        
-        session.close()
+        await update.message.reply_text("".join(parts), reply_markup=reply_markup, parse_mode='Markdown')
     
     async def show_settings(self, query, context):
         """Show user settings"""
-        keyboard = [
-            [InlineKeyboardButton("🔔 Notifications", callback_data="settings_notifications")],
-            [InlineKeyboardButton("💰 Price Alerts", callback_data="settings_price_alerts")],
-            [InlineKeyboardButton("📂 Preferred Categories", callback_data="settings_categories")],
-            [InlineKeyboardButton("🔙 Back to Main Menu", callback_data="main_menu")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text(
-            "⚙️ **Settings**\n\n"
-            "Manage your preferences and notifications:",
-            reply_markup=reply_markup,
+            SETTINGS_TEXT,
+            reply_markup=SETTINGS_MARKUP,
             parse_mode='Markdown'
         )
     
@@ -522,10 +578,12 @@ Need more help? Contact @YourSupportUsername
     async def show_notification_settings(self, query, context):
         """Show notification settings"""
         user_id = query.from_user.id
-        session = self.db.get_session()
-        user = session.query(User).filter_by(telegram_id=user_id).first()
+        async with self.db.async_session_scope() as session:
+            notifications_enabled = await session.scalar(
+                select(User.notifications_enabled).filter_by(telegram_id=user_id).limit(1)
+            )
         
-        notifications_status = "✅ Enabled" if user and user.notifications_enabled else "❌ Disabled"
+        notifications_status = "✅ Enabled" if notifications_enabled else "❌ Disabled"
         
         keyboard = [
             [InlineKeyboardButton(f"🔔 Daily Deals: {notifications_status}", callback_data="toggle_notifications")],
@@ -540,34 +598,19 @@ Need more help? Contact @YourSupportUsername
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
-        session.close()
     
     async def show_price_alert_settings(self, query, context):
         """Show price alert settings"""
-        keyboard = [
-            [InlineKeyboardButton("🔔 Set Price Alert", callback_data="create_price_alert")],
-            [InlineKeyboardButton("📋 My Alerts", callback_data="view_price_alerts")],
-            [InlineKeyboardButton("🔙 Back to Settings", callback_data="settings")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text(
-            "💰 **Price Alert Settings**\n\n"
-            "Get notified when products drop to your target price!\n\n"
-            "**Features:**\n"
-            "• Set custom price targets\n"
-            "• Automatic price monitoring\n"
-            "• Instant notifications\n\n"
-            "*Note: Price alerts are currently in development*",
-            reply_markup=reply_markup,
+            PRICE_ALERTS_TEXT,
+            reply_markup=PRICE_ALERTS_MARKUP,
             parse_mode='Markdown'
         )
     
     async def show_category_preferences(self, query, context):
         """Show category preferences"""
         user_id = query.from_user.id
-        session = self.db.get_session()
-        categories = session.query(Category).all()
+        categories = await self._get_categories()
         
         keyboard = []
         for category in categories[:8]:  # Show first 8 categories
@@ -586,23 +629,25 @@ Need more help? Contact @YourSupportUsername
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
-        session.close()
     
     async def toggle_notifications(self, query, context):
         """Toggle user notifications"""
         user_id = query.from_user.id
-        session = self.db.get_session()
-        user = session.query(User).filter_by(telegram_id=user_id).first()
-        
-        if user:
-            user.notifications_enabled = not user.notifications_enabled
-            session.commit()
-            status = "enabled" if user.notifications_enabled else "disabled"
+        async with self.db.async_session_scope() as session:
+            # Flip the flag and read back the new state in a single atomic statement
+            notifications_enabled = (await session.execute(
+                update(User)
+                .where(User.telegram_id == user_id)
+                .values(notifications_enabled=~User.notifications_enabled)
+                .returning(User.notifications_enabled)
+            )).scalar_one_or_none()
+        
+        if notifications_enabled is not None:
+            status = "enabled" if notifications_enabled else "disabled"
             await query.answer(f"Notifications {status}!")
         else:
             await query.answer("User not found!")
         
-        session.close()
         await self.show_notification_settings(query, context)
     
     async def toggle_category_preference(self, query, context, category_name):
@@ -611,47 +656,212 @@ Need more help? Contact @YourSupportUsername
         await query.answer(f"Category preference updated!")
         await self.show_category_preferences(query, context)
     
-    def register_user(self, telegram_user):
+    async def register_user(self, telegram_user):
         """Register or update user in database"""
-        session = self.db.get_session()
-        
-        user = session.query(User).filter_by(telegram_id=telegram_user.id).first()
-        
-        if not user:
-            user = User(
-                telegram_id=telegram_user.id,
-                username=telegram_user.username,
-                first_name=telegram_user.first_name,
-                last_name=telegram_user.last_name
-            )
-            session.add(user)
-        else:
-            # Update user info
-            user.username = telegram_user.username
-            user.first_name = telegram_user.first_name
-            user.last_name = telegram_user.last_name
-            user.last_active = datetime.utcnow()
+        make_insert = _UPSERT_INSERTS.get(self.db.async_engine.dialect.name)
+        if make_insert:
+            # Insert or update in a single statement keyed on the unique telegram_id
+            profile = {
+                'username': telegram_user.username,
+                'first_name': telegram_user.first_name,
+                'last_name': telegram_user.last_name
+            }
+            stmt = make_insert(User).values(telegram_id=telegram_user.id, **profile)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[User.telegram_id],
+                set_={**profile, 'last_active': datetime.utcnow()}
+            ).returning(User.id)
+            async with self.db.async_session_scope() as session:
+                self._remember_user_id(telegram_user.id, (await session.execute(stmt)).scalar_one())
+            return
         
-        session.commit()
+        async with self.db.async_session_scope() as session:
+            user = await session.scalar(select(User).filter_by(telegram_id=telegram_user.id).limit(1))
+            
+            if not user:
+                user = User(
+                    telegram_id=telegram_user.id,
+                    username=telegram_user.username,
+                    first_name=telegram_user.first_name,
+                    last_name=telegram_user.last_name
+                )
+                session.add(user)
+            else:
+                # Update user info
+                user.username = telegram_user.username
+                user.first_name = telegram_user.first_name
+                user.last_name = telegram_user.last_name
+                user.last_active = datetime.utcnow()
+            await session.flush()
+            self._remember_user_id(telegram_user.id, user.id)
     
     def track_click(self, telegram_user_id, product_id):
-        """Track product click for analytics"""
-        session = self.db.get_session()
-        
-        user = session.query(User).filter_by(telegram_id=telegram_user_id).first()
-        if user:
-            click = ClickTracking(
-                user_id=user.id,
-                product_id=product_id,
-                clicked_at=datetime.utcnow()
-            )
-            session.add(click)
-            session.commit()
+        """Track product click for analytics (queued, written by the background flusher)"""
+        self._click_queue.put_nowait((telegram_user_id, product_id, datetime.utcnow()))
+        if self._click_flusher is None or self._click_flusher.done():
+            self._click_flusher = asyncio.create_task(self._flush_clicks())
+    
+    async def _flush_clicks(self):
+        """Background writer: wait for a click, then collect a batch and insert it"""
+        loop = asyncio.get_running_loop()
+        while True:
+            clicks = [await self._click_queue.get()]
+            deadline = loop.time() + CLICK_FLUSH_INTERVAL
+            while len(clicks) < CLICK_FLUSH_BATCH:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    clicks.append(await asyncio.wait_for(self._click_queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                await self._write_clicks(clicks)
+            except Exception as e:
+                logger.error(f"Error writing {len(clicks)} tracked clicks: {e}")
+    
+    async def flush_clicks(self, application=None):
+        """Stop the background writer and write every queued click (the Application's post_shutdown hook)"""
+        if self._click_flusher is not None and not self._click_flusher.done():
+            self._click_flusher.cancel()
+            try:
+                await self._click_flusher
+            except asyncio.CancelledError:
+                pass
+        
+        clicks = []
+        while not self._click_queue.empty():
+            clicks.append(self._click_queue.get_nowait())
+            if len(clicks) >= CLICK_FLUSH_BATCH:
+                await self._write_clicks(clicks)
+                clicks = []
+        if clicks:
+            await self._write_clicks(clicks)
+    
+    def _remember_user_id(self, telegram_user_id, user_id):
+        """Cache a user's users.id, evicting the least recently used beyond USER_ID_CACHE_SIZE"""
+        self._user_ids[telegram_user_id] = user_id
+        self._user_ids.move_to_end(telegram_user_id)
+        if len(self._user_ids) > USER_ID_CACHE_SIZE:
+            self._user_ids.popitem(last=False)
+    
+    async def _write_clicks(self, clicks):
+        """Insert a batch of clicks with one executemany, looking up only uncached user ids"""
+        user_ids = {}  # this batch's ids, unaffected by evictions while it is written
+        missing = set()
+        for telegram_user_id, _, _ in clicks:
+            if telegram_user_id in self._user_ids:
+                self._user_ids.move_to_end(telegram_user_id)
+                user_ids[telegram_user_id] = self._user_ids[telegram_user_id]
+            else:
+                missing.add(telegram_user_id)
+        
+        if missing:
+            async with self.db.async_session_scope() as session:
+                for telegram_user_id, user_id in (await session.execute(
+                    select(User.telegram_id, User.id).where(User.telegram_id.in_(missing))
+                )).all():
+                    user_ids[telegram_user_id] = user_id
+                    self._remember_user_id(telegram_user_id, user_id)
+        
+        rows = [
+            {'user_id': user_ids[telegram_user_id], 'product_id': product_id, 'clicked_at': clicked_at}
+            for telegram_user_id, product_id, clicked_at in clicks
+            if telegram_user_id in user_ids
+        ]
+        if not rows:
+            return
+        
+        try:
+            await self._write_click_rows(rows)
+        except IntegrityError as e:
+            # Keep the good rows of a batch that one bad row rejected
+            logger.warning(f"Batch of {len(rows)} tracked clicks rejected, retrying row by row: {e}")
+            for row in rows:
+                try:
+                    await self._write_click_rows([row])
+                except Exception as row_error:
+                    logger.error(f"Dropping tracked click {row}: {row_error}")
+    
+    async def _write_click_rows(self, rows):
+        """Insert click rows and add them to the daily rollup in one transaction"""
+        async with self.db.async_session_scope() as session:
+            await session.execute(insert(ClickTracking), rows)
+            
+            # Keep the per-day product totals behind the popularity stats current
+            upsert = click_rollup_upsert(self.db.async_engine.dialect.name)
+            if upsert is not None:
+                await session.execute(upsert, click_rollup_params(
+                    (row['clicked_at'], row['product_id']) for row in rows
+                ))
+    
+    async def _get_categories(self):
+        """Get all categories, reusing the cached list within CATEGORIES_CACHE_TTL"""
+        fetched_at, categories = self._cat_cache
+        now = time.monotonic()
+        if categories and now - fetched_at < CATEGORIES_CACHE_TTL:
+            return categories
+        
+        async with self.db.async_session_scope() as session:
+            rows = (await session.execute(
+                select(Category.id, Category.name, Category.display_name, Category.emoji)
+            )).all()
+        
+        categories = [CategoryDTO(*row) for row in rows]
+        self._cat_cache = (now, categories)
+        return categories
+    
+    def _get_today(self):
+        """Today's local date, recomputed only once the cached day has passed midnight"""
+        today, next_midnight = self._today
+        now = time.monotonic()
+        if now < next_midnight:
+            return today
+        
+        current = datetime.now()
+        midnight = datetime.combine(current.date() + timedelta(days=1), datetime.min.time())
+        self._today = (current.date(), now + (midnight - current).total_seconds())
+        return current.date()
+    
+    async def _get_daily_deals(self):
+        """Get today's top deals by discount, reusing the cached list within DEALS_CACHE_TTL"""
+        fetched_at, day, deals = self._deals_cache
+        now = time.monotonic()
+        today = self._get_today()
+        if day == today and now - fetched_at < DEALS_CACHE_TTL:
+            return deals
+        
+        # Products marked as daily deals or created today, with their stores loaded
+        # so the detached rows can be formatted without a session
+        async with self.db.async_session_scope() as session:
+            deals = (await session.execute(
+                select(Product).options(selectinload(Product.store)).where(
+                    or_(
+                        Product.is_daily_deal == True,
+                        Product.created_at >= today
+                    ),
+                    Product.is_active == True
+                ).order_by(Product.discount_percentage.desc().nulls_last()).limit(DEALS_CACHE_SIZE)
+            )).scalars().all()
+        
+        self._deals_cache = (now, today, deals)
+        return deals
+    
+    def _rendered_deals(self, deals, renderer):
+        """Render the deals list once per refresh and share the result across users"""
+        source, rendered = self._deals_rendered
+        if source is not deals:
+            rendered = {}
+            self._deals_rendered = (deals, rendered)
+        
+        if renderer not in rendered:
+            rendered[renderer] = renderer(deals)
+        return rendered[renderer]
     
-    def get_categories_text(self):
+    async def get_categories_text(self):
         """Get formatted categories text"""
-        session = self.db.get_session()
-        categories = session.query(Category).all()
+        categories = await self._get_categories()
         
         text = ""
         for category in categories:
@@ -660,28 +870,11 @@ Need more help? Contact @YourSupportUsername
         
         return text
     
-    def get_daily_deals_preview(self):
+    async def get_daily_deals_preview(self):
         """Get preview of top 3 daily deals for chat message"""
-        session = self.db.get_session()
-        
-        today = datetime.now().date()
-        daily_deals = session.query(Product).filter(
-            or_(
-                Product.is_daily_deal == True,
-                Product.created_at >= today
-            )
-        ).filter(Product.is_active == True).order_by(Product.discount_percentage.desc()).limit(3).all()
+        daily_deals = await self._get_daily_deals()
         
         if not daily_deals:
             return ""
         
-        preview_text = ""
-        for i, product in enumerate(daily_deals, 1):
-            discount_text = f" (-{product.discount_percentage:.0f}%)" if product.discount_percentage else ""
-            price_text = f"${product.price:.2f}" if product.price else "Check Price"
-            
-            preview_text += f"{i}. **{product.title[:35]}{'...' if len(product.title) > 35 else ''}**\n"
-            preview_text += f"   💰 {price_text}{discount_text} | 🏪 {product.store.name if product.store else 'Store'}\n"
-        
-        preview_text += "\n👆 *Tap 'Open Deals App' to see all deals!*"
-        return preview_text
+        return self._rendered_deals(daily_deals, _render_deals_preview)
@@ -4,44 +4,62 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# Settings are read once from a plain-dict snapshot of the environment
+_ENV = dict(os.environ)
+
 class Config:
     # Telegram Bot Configuration
-    TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-    TELEGRAM_ADMIN_ID = int(os.getenv('TELEGRAM_ADMIN_ID', 0))
+    TELEGRAM_BOT_TOKEN = _ENV.get('TELEGRAM_BOT_TOKEN')
+    TELEGRAM_ADMIN_ID = int(_ENV.get('TELEGRAM_ADMIN_ID', 0))
+    # Outgoing Bot API connections (256 matches the library default) and request timeouts
+    TELEGRAM_CONNECTION_POOL_SIZE = int(_ENV.get('TELEGRAM_CONNECTION_POOL_SIZE', 256))
+    TELEGRAM_POOL_TIMEOUT = float(_ENV.get('TELEGRAM_POOL_TIMEOUT', 30))
+    TELEGRAM_CONNECT_TIMEOUT = float(_ENV.get('TELEGRAM_CONNECT_TIMEOUT', 10))
+    TELEGRAM_READ_TIMEOUT = float(_ENV.get('TELEGRAM_READ_TIMEOUT', 20))
     
     # Database Configuration
-    DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///affiliate_bot.db')
+    DATABASE_URL = _ENV.get('DATABASE_URL', 'sqlite:///affiliate_bot.db')
+    DB_POOL_SIZE = int(_ENV.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(_ENV.get('DB_MAX_OVERFLOW', 10))
+    DB_QUERY_CACHE_SIZE = int(_ENV.get('DB_QUERY_CACHE_SIZE', 1200))
+    # Read replica for analytics queries (defaults to the primary database)
+    DATABASE_READ_URL = _ENV.get('DATABASE_READ_URL', DATABASE_URL)
+    DB_READ_POOL_SIZE = int(_ENV.get('DB_READ_POOL_SIZE', 5))
+    # Raw click rows older than this are pruned (daily totals live in click_stats_daily)
+    CLICK_RETENTION_DAYS = int(_ENV.get('CLICK_RETENTION_DAYS', 90))
+    # Estimate per-product unique users with HyperLogLog (PostgreSQL + hll extension)
+    ANALYTICS_APPROX_DISTINCT = _ENV.get('ANALYTICS_APPROX_DISTINCT', 'false').lower() == 'true'
     
     # Affiliate Network Configuration
-    AMAZON_ACCESS_KEY = os.getenv('AMAZON_ACCESS_KEY')
-    AMAZON_SECRET_KEY = os.getenv('AMAZON_SECRET_KEY')
-    AMAZON_ASSOCIATE_TAG = os.getenv('AMAZON_ASSOCIATE_TAG')
+    AMAZON_ACCESS_KEY = _ENV.get('AMAZON_ACCESS_KEY')
+    AMAZON_SECRET_KEY = _ENV.get('AMAZON_SECRET_KEY')
+    AMAZON_ASSOCIATE_TAG = _ENV.get('AMAZON_ASSOCIATE_TAG')
     
-    CLICKBANK_API_KEY = os.getenv('CLICKBANK_API_KEY')
-    SHAREASALE_API_TOKEN = os.getenv('SHAREASALE_API_TOKEN')
-    SHAREASALE_SECRET_KEY = os.getenv('SHAREASALE_SECRET_KEY')
+    CLICKBANK_API_KEY = _ENV.get('CLICKBANK_API_KEY')
+    SHAREASALE_API_TOKEN = _ENV.get('SHAREASALE_API_TOKEN')
+    SHAREASALE_SECRET_KEY = _ENV.get('SHAREASALE_SECRET_KEY')
     
     # Web Scraping Settings
-    USER_AGENT = os.getenv('USER_AGENT', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')
-    REQUEST_DELAY = int(os.getenv('REQUEST_DELAY', 1))
+    USER_AGENT = _ENV.get('USER_AGENT', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')
+    REQUEST_DELAY = int(_ENV.get('REQUEST_DELAY', 1))
     
     # Logging
-    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_LEVEL = _ENV.get('LOG_LEVEL', 'INFO')
     
-    # Product Categories
+    # Product Categories as (emoji, display name)
     CATEGORIES = {
-        'daily_deals': '🔥 Daily Deals',
-        'electronics': '📱 Electronics',
-        'mens_clothing': '👔 Men\'s Clothing',
-        'womens_clothing': '👗 Women\'s Clothing',
-        'beauty': '💄 Beauty Products',
-        'household': '🏠 Household Items',
-        'kitchen': '🍳 Kitchen Items',
-        'sports': '⚽ Sports & Fitness',
-        'books': '📚 Books',
-        'toys': '🧸 Toys & Games',
-        'automotive': '🚗 Automotive',
-        'health': '💊 Health & Wellness'
+        'daily_deals': ('🔥', 'Daily Deals'),
+        'electronics': ('📱', 'Electronics'),
+        'mens_clothing': ('👔', 'Men\'s Clothing'),
+        'womens_clothing': ('👗', 'Women\'s Clothing'),
+        'beauty': ('💄', 'Beauty Products'),
+        'household': ('🏠', 'Household Items'),
+        'kitchen': ('🍳', 'Kitchen Items'),
+        'sports': ('⚽', 'Sports & Fitness'),
+        'books': ('📚', 'Books'),
+        'toys': ('🧸', 'Toys & Games'),
+        'automotive': ('🚗', 'Automotive'),
+        'health': ('💊', 'Health & Wellness')
     }
     
     # Supported Stores/Websites
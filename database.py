@@ -1,11 +1,33 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey
+from sqlalchemy import create_engine, event, inspect, text, select, insert, bindparam, func, DDL, Column, Integer, BigInteger, String, Text, Date, DateTime, Float, Boolean, ForeignKey, Index, Computed
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, scoped_session, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.dialects import postgresql, sqlite
+from contextlib import contextmanager, asynccontextmanager
 from datetime import datetime
 from config import Config
 
 Base = declarative_base()
 
+# Async drivers used for each synchronous database backend
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgres': 'postgresql+asyncpg',
+    'postgresql': 'postgresql+asyncpg'
+}
+
+def get_async_database_url(database_url):
+    """Map a synchronous database URL onto its async driver"""
+    scheme, separator, rest = database_url.partition('://')
+    async_scheme = ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)
+    return f"{async_scheme}{separator}{rest}"
+
+# Discount derived from price and original_price, NULL when there is none
+DISCOUNT_PERCENTAGE_SQL = (
+    "CASE WHEN original_price > price "
+    "THEN (original_price - price) * 100.0 / NULLIF(original_price, 0) END"
+)
+
 class Category(Base):
     __tablename__ = 'categories'
     
@@ -38,7 +60,8 @@ class Product(Base):
     description = Column(Text)
     price = Column(Float)
     original_price = Column(Float)
-    discount_percentage = Column(Float)
+    # Maintained by the database from price/original_price; never assign it
+    discount_percentage = Column(Float, Computed(DISCOUNT_PERCENTAGE_SQL, persisted=True))
     image_url = Column(String(500))
     product_url = Column(String(500), nullable=False)
     affiliate_url = Column(String(500), nullable=False)
@@ -60,6 +83,30 @@ class Product(Base):
     category = relationship("Category", back_populates="products")
     store = relationship("Store", back_populates="products")
     clicks = relationship("ClickTracking", back_populates="product")
+    
+    # Admin statistics, listings and bot handlers filter/sort on these columns
+    __table_args__ = (
+        Index('ix_product_created_at', 'created_at'),
+        Index('ix_product_is_active', 'is_active',
+              postgresql_where=is_active, sqlite_where=is_active),
+        Index('ix_product_is_daily_deal', 'is_daily_deal',
+              postgresql_where=is_daily_deal, sqlite_where=is_daily_deal),
+        # Category pages list active products of one category
+        Index('ix_product_active_category', 'category_id',
+              postgresql_where=is_active, sqlite_where=is_active),
+        # Daily deals include active products created today
+        Index('ix_product_active_created_at', 'created_at',
+              postgresql_where=is_active, sqlite_where=is_active),
+        # Trigram GIN indexes let PostgreSQL serve the ILIKE '%query%' product search
+        Index('ix_product_title_trgm', 'title', postgresql_using='gin',
+              postgresql_ops={'title': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_product_description_trgm', 'description', postgresql_using='gin',
+              postgresql_ops={'description': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+
+# The trigram operator classes come from the pg_trgm extension
+event.listen(Product.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
 
 class User(Base):
     __tablename__ = 'users'
@@ -73,6 +120,7 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     
     # User preferences
+    notifications_enabled = Column(Boolean, default=True)
     preferred_categories = Column(Text)  # JSON string of category IDs
     max_price_filter = Column(Float)
     min_discount_filter = Column(Float)
@@ -81,6 +129,10 @@ class User(Base):
     last_active = Column(DateTime, default=datetime.utcnow)
     
     clicks = relationship("ClickTracking", back_populates="user")
+    
+    __table_args__ = (
+        Index('ix_user_created_at', 'created_at'),
+    )
 
 class ClickTracking(Base):
     __tablename__ = 'click_tracking'
@@ -89,49 +141,238 @@ class ClickTracking(Base):
     user_id = Column(Integer, ForeignKey('users.id'))
     product_id = Column(Integer, ForeignKey('products.id'))
     clicked_at = Column(DateTime, default=datetime.utcnow)
+    click_type = Column(String(50), default='affiliate_link')
+    # "metadata" is reserved on declarative models, so map it under another name
+    action_metadata = Column('metadata', Text)  # JSON string for user actions
     ip_address = Column(String(45))
     user_agent = Column(String(500))
     
     user = relationship("User", back_populates="clicks")
     product = relationship("Product", back_populates="clicks")
+    
+    __table_args__ = (
+        Index('ix_ct_user_time', 'user_id', 'clicked_at'),
+        Index('ix_ct_product_time', 'product_id', 'clicked_at'),
+        Index('ix_ct_clicked_at', 'clicked_at'),
+    )
+
+class ClickStatsDaily(Base):
+    """Per-day click totals for each product, maintained by every click writer"""
+    __tablename__ = 'click_stats_daily'
+    
+    date = Column(Date, primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    category_id = Column(Integer, ForeignKey('categories.id'))
+    store_id = Column(Integer, ForeignKey('stores.id'))
+    clicks = Column(Integer, nullable=False, default=0)
+
+def _build_click_rollup_upsert(make_insert):
+    """Upsert adding :clicks to the ClickStatsDaily total of product :product for day :day"""
+    table = ClickStatsDaily.__table__
+    stmt = make_insert(table).from_select(
+        ['date', 'product_id', 'category_id', 'store_id', 'clicks'],
+        select(
+            bindparam('day', type_=Date),
+            Product.id,
+            Product.category_id,
+            Product.store_id,
+            bindparam('clicks_added', type_=Integer)
+        ).where(Product.id == bindparam('product'))
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.date, table.c.product_id],
+        set_={'clicks': table.c.clicks + stmt.excluded.clicks}
+    )
+
+# Built once per dialect that supports ON CONFLICT upserts
+_CLICK_ROLLUP_UPSERTS = {
+    'postgresql': _build_click_rollup_upsert(postgresql.insert),
+    'sqlite': _build_click_rollup_upsert(sqlite.insert),
+}
+
+def click_rollup_params(clicks):
+    """Group (clicked_at, product_id) pairs into parameter sets for the click rollup upsert"""
+    counts = {}
+    for clicked_at, product_id in clicks:
+        if product_id is not None:
+            key = (clicked_at.date(), product_id)
+            counts[key] = counts.get(key, 0) + 1
+    return [
+        {'day': day, 'product': product_id, 'clicks_added': added}
+        for (day, product_id), added in counts.items()
+    ]
+
+def click_rollup_upsert(dialect_name):
+    """Get the ClickStatsDaily upsert for a dialect, or None if it has no upsert support"""
+    return _CLICK_ROLLUP_UPSERTS.get(dialect_name)
+
+# Fills a newly created click_stats_daily from the existing click history
+_BACKFILL_CLICK_STATS = insert(ClickStatsDaily).from_select(
+    ['date', 'product_id', 'category_id', 'store_id', 'clicks'],
+    select(
+        func.date(ClickTracking.clicked_at),
+        Product.id,
+        Product.category_id,
+        Product.store_id,
+        func.count()
+    ).join(
+        Product, Product.id == ClickTracking.product_id
+    ).group_by(
+        func.date(ClickTracking.clicked_at), Product.id, Product.category_id, Product.store_id
+    )
+)
+
+class AuthorizedGroup(Base):
+    """A Telegram group that has authorized the bot to post deals"""
+    __tablename__ = 'authorized_groups'
+    
+    chat_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    name = Column(String(255))
+    authorized_by = Column(BigInteger)
+    auto_deals = Column(Boolean, default=True)
+    categories = Column(Text)  # JSON list of category names, empty means all
+    posting_frequency = Column(String(20), default='daily')  # daily, hourly, manual
+    authorized_at = Column(DateTime, default=datetime.utcnow)
+
+# Columns added to existing tables after their first release, as
+# (table, column, column DDL); DatabaseManager adds any that are missing
+ADDED_COLUMNS = [
+    ('users', 'notifications_enabled', 'BOOLEAN DEFAULT TRUE'),
+    ('click_tracking', 'click_type', "VARCHAR(50) DEFAULT 'affiliate_link'"),
+    ('click_tracking', 'metadata', 'TEXT'),
+]
 
 class DatabaseManager:
-    def __init__(self):
-        self.engine = create_engine(Config.DATABASE_URL)
+    """Process-wide database access; every DatabaseManager() returns the same instance,
+    so the engines, connection pools and schema check are set up only once"""
+    _instance = None
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._setup()
+        return cls._instance
+    
+    def _setup(self):
+        engine_options = {'pool_pre_ping': True, 'query_cache_size': Config.DB_QUERY_CACHE_SIZE}
+        if not Config.DATABASE_URL.startswith('sqlite'):
+            engine_options['pool_size'] = Config.DB_POOL_SIZE
+            engine_options['max_overflow'] = Config.DB_MAX_OVERFLOW
+        
+        self.engine = create_engine(Config.DATABASE_URL, **engine_options)
+        existing_tables = set(inspect(self.engine).get_table_names())
         Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+        self._migrate(existing_tables)
+        self.Session = sessionmaker(bind=self.engine)
+        # Legacy get_session() callers share one session per thread
+        self.session = scoped_session(self.Session)
+        
+        # Async engine for handlers running on the bot's event loop
+        self.async_engine = create_async_engine(get_async_database_url(Config.DATABASE_URL), **engine_options)
+        self.AsyncSession = async_sessionmaker(bind=self.async_engine, expire_on_commit=False)
+        
+        self._category_index = None  # lower-cased category name -> id
     
-    def add_default_categories(self):
-        """Add default product categories"""
-        for key, display_name in Config.CATEGORIES.items():
-            emoji = display_name.split()[0] if display_name.split() else ''
-            name_without_emoji = ' '.join(display_name.split()[1:]) if len(display_name.split()) > 1 else display_name
+    def _migrate(self, existing_tables):
+        """Bring tables created by older releases up to date with the models"""
+        inspector = inspect(self.engine)
+        columns = {}
+        with self.engine.begin() as conn:
+            # The click rollup was added after click_tracking; seed it from the history
+            if (ClickStatsDaily.__tablename__ not in existing_tables
+                    and ClickTracking.__tablename__ in existing_tables):
+                conn.execute(_BACKFILL_CLICK_STATS)
+            
+            for table, column, ddl in ADDED_COLUMNS:
+                if table not in columns:
+                    columns[table] = {c['name'] for c in inspector.get_columns(table)}
+                if column not in columns[table]:
+                    conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+                    columns[table].add(column)
             
-            existing = self.session.query(Category).filter_by(name=key).first()
-            if not existing:
-                category = Category(
-                    name=key,
-                    display_name=name_without_emoji,
-                    emoji=emoji
+            # Older products tables hold discount_percentage as a plain column that
+            # nothing writes any more; replace it with the generated one
+            if Product.__tablename__ in existing_tables:
+                discount = next(
+                    c for c in inspector.get_columns(Product.__tablename__)
+                    if c['name'] == 'discount_percentage'
                 )
-                self.session.add(category)
-        
+                if not discount.get('computed'):
+                    # SQLite can only add virtual generated columns
+                    storage = 'VIRTUAL' if self.engine.dialect.name == 'sqlite' else 'STORED'
+                    conn.execute(text('ALTER TABLE products DROP COLUMN discount_percentage'))
+                    conn.execute(text(
+                        'ALTER TABLE products ADD COLUMN discount_percentage FLOAT '
+                        f'GENERATED ALWAYS AS ({DISCOUNT_PERCENTAGE_SQL}) {storage}'
+                    ))
+            
+            # create_all skips tables that already exist, so indexes added to the
+            # models since then are created here; the GIN indexes need pg_trgm first
+            if self.engine.dialect.name == 'postgresql':
+                conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+            for table in Base.metadata.sorted_tables:
+                if table.name in existing_tables:
+                    for index in table.indexes:
+                        index.create(conn, checkfirst=True)
+    
+    def add_default_categories(self):
+        """Add default product categories"""
+        existing = {name for (name,) in self.session.query(Category.name)}
+        self.session.add_all([
+            Category(name=key, display_name=display_name, emoji=emoji)
+            for key, (emoji, display_name) in Config.CATEGORIES.items()
+            if key not in existing
+        ])
         self.session.commit()
+        self._category_index = None
     
     def add_default_stores(self):
         """Add default stores"""
-        for store_name in Config.SUPPORTED_STORES:
-            existing = self.session.query(Store).filter_by(name=store_name).first()
-            if not existing:
-                store = Store(name=store_name)
-                self.session.add(store)
-        
+        existing = {name for (name,) in self.session.query(Store.name)}
+        self.session.add_all([
+            Store(name=store_name)
+            for store_name in Config.SUPPORTED_STORES
+            if store_name not in existing
+        ])
         self.session.commit()
     
+    def get_category_index(self, refresh=False):
+        """Map lower-cased category names to ids, loaded once and reused until refreshed"""
+        if self._category_index is None or refresh:
+            with self.session_scope() as session:
+                self._category_index = {
+                    name.lower(): category_id
+                    for category_id, name in session.query(Category.id, Category.name)
+                }
+        return self._category_index
+    
     def get_session(self):
         return self.session
     
+    @contextmanager
+    def session_scope(self):
+        """Provide a short-lived session that is always returned to the pool"""
+        session = self.Session()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @asynccontextmanager
+    async def async_session_scope(self):
+        """Async counterpart of session_scope for use inside event-loop handlers"""
+        async with self.AsyncSession() as session:
+            try:
+                yield session
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+    
     def close(self):
         self.session.close()
 
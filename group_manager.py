@@ -3,29 +3,79 @@ Group Manager for Telegram Affiliate Bot
 Handles group functionality for sharing product links directly
 """
 
+import json
 import logging
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
 from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
 from telegram.constants import ChatType, ParseMode
-from database import DatabaseManager, Product, Category, Store
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from database import DatabaseManager, Product, Store, AuthorizedGroup
 from analytics import AnalyticsManager
 import asyncio
-import random
 
 logger = logging.getLogger(__name__)
 
+# Groups whose authorization (or lack of it) is remembered between commands
+GROUP_CACHE_SIZE = 1024
+
 class GroupManager:
     def __init__(self, analytics_manager: AnalyticsManager = None):
         """Initialize Group Manager"""
         self.db = DatabaseManager()
         self.analytics = analytics_manager or AnalyticsManager()
-        self.authorized_groups = set()  # Store authorized group IDs
-        self.group_settings = {}  # Store group-specific settings
+        self.group_settings = {}  # chat_id -> settings of the authorized group, or None
         
         logger.info("Group Manager initialized")
     
+    @staticmethod
+    def _settings_from_group(group: AuthorizedGroup) -> Dict[str, Any]:
+        """Build the settings dict of a stored group"""
+        return {
+            'name': group.name,
+            'authorized_by': group.authorized_by,
+            'authorized_at': group.authorized_at,
+            'auto_deals': group.auto_deals,
+            'categories': json.loads(group.categories) if group.categories else [],
+            'posting_frequency': group.posting_frequency
+        }
+    
+    def _get_group_settings(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        """Get the settings of an authorized group, or None if it isn't authorized"""
+        if chat_id in self.group_settings:
+            return self.group_settings[chat_id]
+        
+        with self.db.session_scope() as session:
+            group = session.get(AuthorizedGroup, chat_id)
+            settings = self._settings_from_group(group) if group else None
+        
+        if len(self.group_settings) >= GROUP_CACHE_SIZE:
+            self.group_settings.clear()
+        self.group_settings[chat_id] = settings
+        return settings
+    
+    def _remove_group(self, chat_id: int) -> bool:
+        """Delete a group's authorization; returns whether it was authorized"""
+        with self.db.session_scope() as session:
+            deleted = session.query(AuthorizedGroup).filter_by(chat_id=chat_id).delete()
+        self.group_settings[chat_id] = None
+        return deleted > 0
+    
+    def _find_category(self, search: str):
+        """Find the first category whose name contains search, as (name, id)"""
+        for refresh in (False, True):
+            # Reload once on a miss in case categories were added since
+            match = next(
+                ((name, category_id) for name, category_id in self.db.get_category_index(refresh).items()
+                 if search in name),
+                None
+            )
+            if match:
+                return match
+        return None
+    
     def is_admin_or_creator(self, chat_member: ChatMember) -> bool:
         """Check if user is admin or creator of the group"""
         return chat_member.status in ['administrator', 'creator']
@@ -50,16 +100,18 @@ class GroupManager:
             await update.message.reply_text("❌ Error checking permissions!")
             return
         
-        # Authorize the group
-        self.authorized_groups.add(chat.id)
-        self.group_settings[chat.id] = {
-            'name': chat.title,
-            'authorized_by': user.id,
-            'authorized_at': datetime.now(),
-            'auto_deals': True,
-            'categories': [],  # Empty means all categories
-            'posting_frequency': 'daily'  # daily, hourly, manual
-        }
+        # Authorize the group, replacing any earlier authorization
+        with self.db.session_scope() as session:
+            group = session.merge(AuthorizedGroup(
+                chat_id=chat.id,
+                name=chat.title,
+                authorized_by=user.id,
+                authorized_at=datetime.now(),
+                auto_deals=True,
+                categories=None,
+                posting_frequency='daily'
+            ))
+            self.group_settings[chat.id] = self._settings_from_group(group)
         
         welcome_message = f"""✅ **Group Authorized Successfully!**
 
@@ -102,11 +154,7 @@ Ready to start sharing amazing deals! 🚀"""
             return
         
         # Deauthorize the group
-        if chat.id in self.authorized_groups:
-            self.authorized_groups.remove(chat.id)
-            if chat.id in self.group_settings:
-                del self.group_settings[chat.id]
-            
+        if self._remove_group(chat.id):
             await update.message.reply_text("✅ Group deauthorized. No more automatic deals will be posted.")
             logger.info(f"Group {chat.id} deauthorized by user {user.id}")
         else:
@@ -116,37 +164,37 @@ Ready to start sharing amazing deals! 🚀"""
         """Post current deals to the group"""
         chat = update.effective_chat
         
-        if chat.id not in self.authorized_groups:
+        if self._get_group_settings(chat.id) is None:
             await update.message.reply_text("❌ This group is not authorized. Use /authorize_group first!")
             return
         
         # Get daily deals
-        session = self.db.get_session()
         try:
-            # Get products with discounts (daily deals)
-            deals = session.query(Product).filter(
-                Product.discount_percentage > 0
-            ).order_by(Product.discount_percentage.desc()).limit(5).all()
+            # Build the message inside the session, then release it before sending
+            with self.db.session_scope() as session:
+                # Get products with discounts (daily deals)
+                deals = session.query(Product).options(joinedload(Product.store)).filter(
+                    Product.discount_percentage > 0
+                ).order_by(Product.discount_percentage.desc()).limit(5).all()
+                
+                deals_message = "🔥 **TODAY'S HOT DEALS** 🔥\n\n"
+                
+                for i, product in enumerate(deals, 1):
+                    savings = product.original_price - product.price
+                    
+                    deals_message += f"**{i}. {product.title}**\n"
+                    deals_message += f"💰 ~~${product.original_price:.2f}~~ **${product.price:.2f}**\n"
+                    deals_message += f"💸 Save ${savings:.2f} ({product.discount_percentage:.0f}% OFF)\n"
+                    deals_message += f"⭐ {product.rating}/5 ({product.review_count} reviews)\n"
+                    deals_message += f"🛒 [**GET DEAL**]({product.affiliate_url})\n"
+                    deals_message += f"🏪 {product.store.name}\n\n"
+                
+                deals_message += "💡 *Click 'GET DEAL' to purchase with our affiliate link*"
             
             if not deals:
                 await update.message.reply_text("😔 No deals available right now. Check back later!")
                 return
             
-            deals_message = "🔥 **TODAY'S HOT DEALS** 🔥\n\n"
-            
-            for i, product in enumerate(deals, 1):
-                original_price = product.price / (1 - product.discount_percentage / 100)
-                savings = original_price - product.price
-                
-                deals_message += f"**{i}. {product.name}**\n"
-                deals_message += f"💰 ~~${original_price:.2f}~~ **${product.price:.2f}**\n"
-                deals_message += f"💸 Save ${savings:.2f} ({product.discount_percentage}% OFF)\n"
-                deals_message += f"⭐ {product.rating}/5 ({product.reviews_count} reviews)\n"
-                deals_message += f"🛒 [**GET DEAL**]({product.affiliate_url})\n"
-                deals_message += f"🏪 {product.store.name}\n\n"
-            
-            deals_message += "💡 *Click 'GET DEAL' to purchase with our affiliate link*"
-            
             await context.bot.send_message(
                 chat_id=chat.id,
                 text=deals_message,
@@ -160,14 +208,12 @@ Ready to start sharing amazing deals! 🚀"""
         except Exception as e:
             logger.error(f"Error posting deals to group {chat.id}: {e}")
             await update.message.reply_text("❌ Error fetching deals. Please try again later.")
-        finally:
-            session.close()
     
     async def post_category_products(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Post products from a specific category"""
         chat = update.effective_chat
         
-        if chat.id not in self.authorized_groups:
+        if self._get_group_settings(chat.id) is None:
             await update.message.reply_text("❌ This group is not authorized. Use /authorize_group first!")
             return
         
@@ -178,42 +224,42 @@ Ready to start sharing amazing deals! 🚀"""
         
         category_name = " ".join(context.args).lower()
         
-        session = self.db.get_session()
+        # Find category
+        category = self._find_category(category_name)
+        
+        if not category:
+            await update.message.reply_text(f"❌ Category '{category_name}' not found!")
+            return
+        
+        found_name, category_id = category
+        
         try:
-            # Find category
-            category = session.query(Category).filter(
-                Category.name.ilike(f"%{category_name}%")
-            ).first()
-            
-            if not category:
-                await update.message.reply_text(f"❌ Category '{category_name}' not found!")
-                return
-            
-            # Get products from category
-            products = session.query(Product).filter(
-                Product.category_id == category.id
-            ).order_by(Product.rating.desc()).limit(3).all()
+            # Build the message inside the session, then release it before sending
+            with self.db.session_scope() as session:
+                # Get products from category
+                products = session.query(Product).options(joinedload(Product.store)).filter(
+                    Product.category_id == category_id
+                ).order_by(Product.rating.desc()).limit(3).all()
+                
+                category_message = f"📱 **{found_name.upper()} PRODUCTS** 📱\n\n"
+                
+                for i, product in enumerate(products, 1):
+                    discount_text = ""
+                    if product.discount_percentage:
+                        discount_text = f" ~~${product.original_price:.2f}~~ ({product.discount_percentage:.0f}% OFF)"
+                    
+                    category_message += f"**{i}. {product.title}**\n"
+                    category_message += f"💰 ${product.price:.2f}{discount_text}\n"
+                    category_message += f"⭐ {product.rating}/5 ({product.review_count} reviews)\n"
+                    category_message += f"🛒 [**BUY NOW**]({product.affiliate_url})\n"
+                    category_message += f"🏪 {product.store.name}\n\n"
+                
+                category_message += "💡 *Click 'BUY NOW' to purchase with our affiliate link*"
             
             if not products:
-                await update.message.reply_text(f"😔 No products found in '{category.name}' category.")
+                await update.message.reply_text(f"😔 No products found in '{found_name}' category.")
                 return
             
-            category_message = f"📱 **{category.name.upper()} PRODUCTS** 📱\n\n"
-            
-            for i, product in enumerate(products, 1):
-                discount_text = ""
-                if product.discount_percentage > 0:
-                    original_price = product.price / (1 - product.discount_percentage / 100)
-                    discount_text = f" ~~${original_price:.2f}~~ ({product.discount_percentage}% OFF)"
-                
-                category_message += f"**{i}. {product.name}**\n"
-                category_message += f"💰 ${product.price:.2f}{discount_text}\n"
-                category_message += f"⭐ {product.rating}/5 ({product.reviews_count} reviews)\n"
-                category_message += f"🛒 [**BUY NOW**]({product.affiliate_url})\n"
-                category_message += f"🏪 {product.store.name}\n\n"
-            
-            category_message += "💡 *Click 'BUY NOW' to purchase with our affiliate link*"
-            
             await context.bot.send_message(
                 chat_id=chat.id,
                 text=category_message,
@@ -227,42 +273,42 @@ Ready to start sharing amazing deals! 🚀"""
         except Exception as e:
             logger.error(f"Error posting category products to group {chat.id}: {e}")
             await update.message.reply_text("❌ Error fetching products. Please try again later.")
-        finally:
-            session.close()
     
     async def post_random_deal(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Post a random deal to the group"""
         chat = update.effective_chat
         
-        if chat.id not in self.authorized_groups:
+        if self._get_group_settings(chat.id) is None:
             await update.message.reply_text("❌ This group is not authorized. Use /authorize_group first!")
             return
         
-        session = self.db.get_session()
         try:
-            # Get a random product with discount
-            products = session.query(Product).filter(
-                Product.discount_percentage > 0
-            ).all()
+            # Build the message inside the session, then release it before sending
+            with self.db.session_scope() as session:
+                # Let the database pick one random discounted product
+                product = session.query(Product).options(
+                    joinedload(Product.store), joinedload(Product.category)
+                ).filter(
+                    Product.discount_percentage > 0
+                ).order_by(func.random()).limit(1).first()
+                
+                if product:
+                    savings = product.original_price - product.price
+                    
+                    deal_message = f"🎲 **RANDOM DEAL ALERT** 🎲\n\n"
+                    deal_message += f"**{product.title}**\n\n"
+                    deal_message += f"💰 ~~${product.original_price:.2f}~~ **${product.price:.2f}**\n"
+                    deal_message += f"💸 Save ${savings:.2f} ({product.discount_percentage:.0f}% OFF)\n"
+                    deal_message += f"⭐ {product.rating}/5 ({product.review_count} reviews)\n"
+                    deal_message += f"📱 Category: {product.category.name}\n"
+                    deal_message += f"🏪 Store: {product.store.name}\n\n"
+                    deal_message += f"🛒 [**GRAB THIS DEAL**]({product.affiliate_url})\n\n"
+                    deal_message += "⚡ *Limited time offer - Act fast!*"
             
-            if not products:
+            if not product:
                 await update.message.reply_text("😔 No deals available right now!")
                 return
             
-            product = random.choice(products)
-            original_price = product.price / (1 - product.discount_percentage / 100)
-            savings = original_price - product.price
-            
-            deal_message = f"🎲 **RANDOM DEAL ALERT** 🎲\n\n"
-            deal_message += f"**{product.name}**\n\n"
-            deal_message += f"💰 ~~${original_price:.2f}~~ **${product.price:.2f}**\n"
-            deal_message += f"💸 Save ${savings:.2f} ({product.discount_percentage}% OFF)\n"
-            deal_message += f"⭐ {product.rating}/5 ({product.reviews_count} reviews)\n"
-            deal_message += f"📱 Category: {product.category.name}\n"
-            deal_message += f"🏪 Store: {product.store.name}\n\n"
-            deal_message += f"🛒 [**GRAB THIS DEAL**]({product.affiliate_url})\n\n"
-            deal_message += "⚡ *Limited time offer - Act fast!*"
-            
             await context.bot.send_message(
                 chat_id=chat.id,
                 text=deal_message,
@@ -276,15 +322,14 @@ Ready to start sharing amazing deals! 🚀"""
         except Exception as e:
             logger.error(f"Error posting random deal to group {chat.id}: {e}")
             await update.message.reply_text("❌ Error fetching deal. Please try again later.")
-        finally:
-            session.close()
     
     async def show_group_settings(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show and manage group settings"""
         chat = update.effective_chat
         user = update.effective_user
         
-        if chat.id not in self.authorized_groups:
+        settings = self._get_group_settings(chat.id)
+        if settings is None:
             await update.message.reply_text("❌ This group is not authorized. Use /authorize_group first!")
             return
         
@@ -298,8 +343,6 @@ Ready to start sharing amazing deals! 🚀"""
             logger.error(f"Error checking admin status: {e}")
             return
         
-        settings = self.group_settings.get(chat.id, {})
-        
         settings_message = f"⚙️ **GROUP SETTINGS** ⚙️\n\n"
         settings_message += f"📱 **Group:** {chat.title}\n"
         settings_message += f"🔄 **Auto Deals:** {'✅ Enabled' if settings.get('auto_deals', True) else '❌ Disabled'}\n"
@@ -316,41 +359,41 @@ Ready to start sharing amazing deals! 🚀"""
     
     async def auto_post_deals(self, context: ContextTypes.DEFAULT_TYPE):
         """Automatically post deals to authorized groups"""
-        for group_id in self.authorized_groups.copy():
-            settings = self.group_settings.get(group_id, {})
-            
-            if not settings.get('auto_deals', True):
-                continue
-            
+        # Only groups with auto posting enabled are loaded
+        with self.db.session_scope() as session:
+            groups = {
+                group.chat_id: self._settings_from_group(group)
+                for group in session.query(AuthorizedGroup).filter(AuthorizedGroup.auto_deals == True)
+            }
+        
+        for group_id, settings in groups.items():
             try:
-                session = self.db.get_session()
-                
-                # Get deals based on group preferences
-                query = session.query(Product).filter(Product.discount_percentage > 0)
-                
-                if settings.get('categories'):
-                    category_names = settings.get('categories')
-                    categories = session.query(Category).filter(
-                        Category.name.in_(category_names)
-                    ).all()
-                    category_ids = [cat.id for cat in categories]
-                    query = query.filter(Product.category_id.in_(category_ids))
-                
-                deals = query.order_by(Product.discount_percentage.desc()).limit(3).all()
-                
-                if deals:
+                # Build the message inside the session, then release it before sending
+                with self.db.session_scope() as session:
+                    # Get deals based on group preferences
+                    query = session.query(Product).filter(Product.discount_percentage > 0)
+                    
+                    if settings.get('categories'):
+                        category_index = self.db.get_category_index()
+                        category_ids = [
+                            category_index[name.lower()] for name in settings.get('categories')
+                            if name.lower() in category_index
+                        ]
+                        query = query.filter(Product.category_id.in_(category_ids))
+                    
+                    deals = query.order_by(Product.discount_percentage.desc()).limit(3).all()
+                    
                     deals_message = "🔥 **AUTO DEALS UPDATE** 🔥\n\n"
                     
                     for i, product in enumerate(deals, 1):
-                        original_price = product.price / (1 - product.discount_percentage / 100)
-                        
-                        deals_message += f"**{i}. {product.name}**\n"
-                        deals_message += f"💰 ~~${original_price:.2f}~~ **${product.price:.2f}**\n"
-                        deals_message += f"💸 {product.discount_percentage}% OFF\n"
+                        deals_message += f"**{i}. {product.title}**\n"
+                        deals_message += f"💰 ~~${product.original_price:.2f}~~ **${product.price:.2f}**\n"
+                        deals_message += f"💸 {product.discount_percentage:.0f}% OFF\n"
                         deals_message += f"🛒 [**GET DEAL**]({product.affiliate_url})\n\n"
                     
                     deals_message += "⚡ *Limited time offers - Don't miss out!*"
-                    
+                
+                if deals:
                     await context.bot.send_message(
                         chat_id=group_id,
                         text=deals_message,
@@ -361,15 +404,11 @@ Ready to start sharing amazing deals! 🚀"""
                     # Track analytics
                     self.analytics.track_group_post(group_id, 'auto_deals', len(deals))
                 
-                session.close()
-                
             except Exception as e:
                 logger.error(f"Error auto-posting to group {group_id}: {e}")
                 # Remove group if bot was removed/blocked
                 if "chat not found" in str(e).lower() or "bot was blocked" in str(e).lower():
-                    self.authorized_groups.discard(group_id)
-                    if group_id in self.group_settings:
-                        del self.group_settings[group_id]
+                    self._remove_group(group_id)
     
     def get_handlers(self):
         """Get all command handlers for groups"""
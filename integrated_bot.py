@@ -23,6 +23,12 @@ from analytics import AnalyticsManager
 from notifications import NotificationManager
 from group_manager import GroupManager
 
+# Run the event loop on uvloop when it is installed (it is not available on Windows)
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Configure logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -47,7 +53,15 @@ class IntegratedAffiliateBot:
         self.group_manager = GroupManager(analytics_manager=self.analytics)
         
         # Create application
-        self.application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
+        self.application = (
+            Application.builder()
+            .token(Config.TELEGRAM_BOT_TOKEN)
+            .connection_pool_size(Config.TELEGRAM_CONNECTION_POOL_SIZE)
+            .pool_timeout(Config.TELEGRAM_POOL_TIMEOUT)
+            .connect_timeout(Config.TELEGRAM_CONNECT_TIMEOUT)
+            .read_timeout(Config.TELEGRAM_READ_TIMEOUT)
+            .build()
+        )
         
         logger.info("Integrated Affiliate Bot initialized")
     
@@ -302,10 +316,16 @@ class IntegratedAffiliateBot:
         await self.application.stop()
         await self.application.shutdown()
         
+        # Write the clicks still queued by the bot handlers
+        await self.bot_handlers.flush_clicks()
+        
         logger.info("Bot shutdown complete")
 
 def main():
     """Main function to run the integrated bot"""
+    if uvloop:
+        uvloop.install()
+    
     try:
         bot = IntegratedAffiliateBot()
         asyncio.run(bot.run())
@@ -15,6 +15,12 @@ from admin_panel import AdminPanel
 from product_scraper import manual_scraping_command
 from mini_app_integration import MiniAppIntegration
 
+# Run the event loop on uvloop when it is installed (it is not available on Windows)
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Configure logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -38,7 +44,16 @@ class AffiliateTelegramBot:
         self.mini_app.start_webapp_server()
         
         # Create application
-        self.application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
+        self.application = (
+            Application.builder()
+            .token(Config.TELEGRAM_BOT_TOKEN)
+            .connection_pool_size(Config.TELEGRAM_CONNECTION_POOL_SIZE)
+            .pool_timeout(Config.TELEGRAM_POOL_TIMEOUT)
+            .connect_timeout(Config.TELEGRAM_CONNECT_TIMEOUT)
+            .read_timeout(Config.TELEGRAM_READ_TIMEOUT)
+            .post_shutdown(self.bot_handlers.flush_clicks)
+            .build()
+        )
         
         # Register handlers
         self.register_handlers()
@@ -168,6 +183,9 @@ def main():
         print("TELEGRAM_ADMIN_ID=your_telegram_user_id")
         return
     
+    if uvloop:
+        uvloop.install()
+    
     # Create and run bot
     bot = AffiliateTelegramBot()
     bot.run()
@@ -23,31 +23,30 @@ class MiniAppIntegration:
     
     async def send_daily_deals_message(self, context, chat_id):
         """Send daily deals message with mini app button"""
-        session = self.db.get_session()
-        
-        # Get top 5 daily deals
-        today = datetime.now().date()
-        daily_deals = session.query(Product).filter(
-            or_(
-                Product.is_daily_deal == True,
-                Product.created_at >= today
-            )
-        ).filter(Product.is_active == True).order_by(Product.discount_percentage.desc()).limit(5).all()
-        
-        if not daily_deals:
-            message = "🔍 No daily deals available right now. Check back later!"
-        else:
-            message = "🔥 **Today's Hot Deals** 🔥\n\n"
+        # Get top 5 daily deals and format them while their stores can still be loaded
+        with self.db.session_scope() as session:
+            today = datetime.now().date()
+            daily_deals = session.query(Product).filter(
+                or_(
+                    Product.is_daily_deal == True,
+                    Product.created_at >= today
+                )
+            ).filter(Product.is_active == True).order_by(Product.discount_percentage.desc().nulls_last()).limit(5).all()
             
-            for i, product in enumerate(daily_deals, 1):
-                discount_text = f" (-{product.discount_percentage:.0f}%)" if product.discount_percentage else ""
-                price_text = f"${product.price:.2f}" if product.price else "Check Price"
+            if not daily_deals:
+                message = "🔍 No daily deals available right now. Check back later!"
+            else:
+                message = "🔥 **Today's Hot Deals** 🔥\n\n"
                 
-                message += f"{i}. **{product.title[:40]}{'...' if len(product.title) > 40 else ''}**\n"
-                message += f"💰 {price_text}{discount_text}\n"
-                message += f"🏪 {product.store.name if product.store else 'Multiple Stores'}\n\n"
-            
-            message += "👆 *Open the app below to see ALL deals and browse categories!*"
+                for i, product in enumerate(daily_deals, 1):
+                    discount_text = f" (-{product.discount_percentage:.0f}%)" if product.discount_percentage else ""
+                    price_text = f"${product.price:.2f}" if product.price else "Check Price"
+                    
+                    message += f"{i}. **{product.title[:40]}{'...' if len(product.title) > 40 else ''}**\n"
+                    message += f"💰 {price_text}{discount_text}\n"
+                    message += f"🏪 {product.store.name if product.store else 'Multiple Stores'}\n\n"
+                
+                message += "👆 *Open the app below to see ALL deals and browse categories!*"
         
         # Use tunnel URL if available, otherwise skip web app button
         keyboard = []
@@ -278,11 +278,6 @@ def populate_sample_data():
         store = next((s for s in stores if s.name == product_data["store"]), None)
         
         if category and store:
-            # Calculate discount percentage
-            discount_pct = 0
-            if product_data.get("original_price"):
-                discount_pct = ((product_data["original_price"] - product_data["price"]) / product_data["original_price"]) * 100
-            
             # Generate affiliate URL (mock)
             base_url = store.website_url or f"https://{store.name.lower()}.com"
             affiliate_url = f"https://affiliate.{base_url.replace('https://', '')}/product/{random.randint(100000, 999999)}"
@@ -293,7 +288,6 @@ def populate_sample_data():
                 description=product_data["description"],
                 price=product_data["price"],
                 original_price=product_data.get("original_price"),
-                discount_percentage=discount_pct if discount_pct > 0 else None,
                 image_url=product_data["image_url"],
                 product_url=product_url,
                 affiliate_url=affiliate_url,
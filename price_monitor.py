@@ -10,17 +10,19 @@ import threading
 import logging
 from datetime import datetime, timedelta
 from database import DatabaseManager, Product, Store, User
-from affiliate_manager import AffiliateManager
 from product_scraper import WebsiteScraper
 from notifications import NotificationManager
+from config import Config
 import random
 
 logger = logging.getLogger(__name__)
 
+# Old click rows are deleted in chunks of this size, one short transaction each
+CLICK_PRUNE_BATCH = 5000
+
 class PriceMonitor:
     def __init__(self):
         self.db = DatabaseManager()
-        self.affiliate_manager = AffiliateManager()
         self.scraper = WebsiteScraper()
         self.notification_manager = NotificationManager()
         self.running = False
@@ -78,11 +80,6 @@ class PriceMonitor:
                     new_price = self._simulate_price_change(old_price)
                     
                     if new_price != old_price:
-                        # Calculate new discount percentage
-                        if product.original_price:
-                            discount_pct = ((product.original_price - new_price) / product.original_price) * 100
-                            product.discount_percentage = discount_pct if discount_pct > 0 else None
-                        
                         product.price = new_price
                         product.updated_at = datetime.utcnow()
                         updated_count += 1
@@ -195,25 +192,30 @@ class PriceMonitor:
     def cleanup_old_data(self):
         """Clean up old tracking data and logs"""
         logger.info("Cleaning up old data...")
-        session = self.db.get_session()
         
         try:
-            # Delete old click tracking data (older than 90 days)
-            cutoff_date = datetime.utcnow() - timedelta(days=90)
+            # Delete click tracking data older than the retention window, oldest
+            # first in bounded batches so no single transaction locks the table for long
+            cutoff_date = datetime.utcnow() - timedelta(days=Config.CLICK_RETENTION_DAYS)
             from database import ClickTracking
             
-            deleted_clicks = session.query(ClickTracking).filter(
-                ClickTracking.clicked_at < cutoff_date
-            ).delete()
+            deleted_clicks = 0
+            while True:
+                with self.db.session_scope() as session:
+                    old_ids = session.query(ClickTracking.id).filter(
+                        ClickTracking.clicked_at < cutoff_date
+                    ).order_by(ClickTracking.clicked_at).limit(CLICK_PRUNE_BATCH).subquery()
+                    deleted = session.query(ClickTracking).filter(
+                        ClickTracking.id.in_(session.query(old_ids.c.id))
+                    ).delete(synchronize_session=False)
+                deleted_clicks += deleted
+                if deleted < CLICK_PRUNE_BATCH:
+                    break
             
-            session.commit()
             logger.info(f"Cleaned up {deleted_clicks} old click tracking records")
             
         except Exception as e:
             logger.error(f"Error cleaning up data: {e}")
-            session.rollback()
-        finally:
-            session.close()
     
     def get_monitoring_stats(self):
         """Get monitoring system statistics"""
@@ -12,11 +12,16 @@ from typing import List, Dict, Optional
 from dataclasses import dataclass
 
 from database import DatabaseManager, Product, Store, Category
-from affiliate_manager import AffiliateManager
+from affiliate_link_generator import RealAffiliateGenerator
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# First decimal number in a price or rating text; thousands separators are
+# stripped with str.translate before matching
+_NUMBER_RE = re.compile(r'\d+\.?\d*')
+_DROP_COMMAS = str.maketrans('', '', ',')
+
 @dataclass
 class ScrapedProduct:
     title: str
@@ -34,7 +39,6 @@ class ScrapedProduct:
 class WebsiteScraper:
     def __init__(self):
         self.db = DatabaseManager()
-        self.affiliate_manager = AffiliateManager()
         self.session = None
         self.headers = {
             'User-Agent': Config.USER_AGENT,
@@ -79,7 +83,7 @@ class WebsiteScraper:
                 async with self.session.get(url) as response:
                     if response.status == 200:
                         html = await response.text()
-                        soup = BeautifulSoup(html, 'html.parser')
+                        soup = BeautifulSoup(html, 'lxml')
                         
                         # Extract products from Amazon pages
                         page_products = self._extract_amazon_products(soup, url)
@@ -200,7 +204,7 @@ class WebsiteScraper:
                 async with self.session.get(url) as response:
                     if response.status == 200:
                         html = await response.text()
-                        soup = BeautifulSoup(html, 'html.parser')
+                        soup = BeautifulSoup(html, 'lxml')
                         
                         page_products = self._extract_ebay_products(soup, url)
                         products.extend(page_products)
@@ -293,7 +297,7 @@ class WebsiteScraper:
             return None
         
         # Remove currency symbols and extract number
-        price_match = re.search(r'[\d,]+\.?\d*', price_text.replace(',', ''))
+        price_match = _NUMBER_RE.search(price_text.translate(_DROP_COMMAS))
         if price_match:
             try:
                 return float(price_match.group())
@@ -306,10 +310,10 @@ class WebsiteScraper:
         if not rating_text:
             return None
         
-        rating_match = re.search(r'(\d+\.?\d*)', rating_text)
+        rating_match = _NUMBER_RE.search(rating_text)
         if rating_match:
             try:
-                rating = float(rating_match.group(1))
+                rating = float(rating_match.group())
                 return rating if 0 <= rating <= 5 else None
             except ValueError:
                 return None
@@ -358,27 +362,37 @@ class AutomatedProductManager:
     def __init__(self):
         self.db = DatabaseManager()
         self.scraper = WebsiteScraper()
-        self.affiliate_manager = AffiliateManager()
+        self.affiliate_manager = RealAffiliateGenerator()
     
-    async def run_automated_scraping(self):
-        """Run automated product scraping from all websites"""
-        logger.info("Starting automated product scraping...")
+    async def run_automated_scraping(self, progress_callback=None):
+        """Run automated product scraping from all websites
+        
+        progress_callback, if given, is awaited with a short description of
+        each stage as it starts.
+        """
+        async def report(stage):
+            logger.info(stage)
+            if progress_callback:
+                await progress_callback(stage)
+        
+        await report("Starting automated product scraping...")
         
         try:
             # Scrape from different websites
             all_products = []
             
             # Amazon
-            logger.info("Scraping Amazon...")
+            await report("Scraping Amazon...")
             amazon_products = await self.scraper.scrape_amazon_deals(50)
             all_products.extend(amazon_products)
             
             # eBay
-            logger.info("Scraping eBay...")
+            await report("Scraping eBay...")
             ebay_products = await self.scraper.scrape_ebay_deals(30)
             all_products.extend(ebay_products)
             
             # Process and save products
+            await report(f"Saving {len(all_products)} scraped products...")
             await self._process_scraped_products(all_products)
             
             logger.info(f"Automated scraping completed. Processed {len(all_products)} products.")
@@ -423,8 +437,7 @@ class AutomatedProductManager:
                 # Generate affiliate link
                 affiliate_url = self.affiliate_manager.generate_affiliate_link(
                     scraped_product.product_url,
-                    scraped_product.store_name,
-                    scraped_product.title
+                    scraped_product.store_name
                 )
                 
                 # Create product
@@ -433,7 +446,6 @@ class AutomatedProductManager:
                     description=scraped_product.description,
                     price=scraped_product.price,
                     original_price=scraped_product.original_price,
-                    discount_percentage=scraped_product.discount_percentage,
                     image_url=scraped_product.image_url,
                     product_url=scraped_product.product_url,
                     affiliate_url=affiliate_url,
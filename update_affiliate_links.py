@@ -149,7 +149,6 @@ def add_sample_real_products():
                 affiliate_url=affiliate_url,
                 rating=product_data['rating'],
                 reviews_count=product_data['reviews_count'],
-                discount_percentage=0,
                 store_id=store.id,
                 category_id=category.id
             )
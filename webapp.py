@@ -24,7 +24,7 @@ class WebAppManager:
                 Product.is_daily_deal == True,
                 Product.created_at >= today
             )
-        ).filter(Product.is_active == True).order_by(Product.discount_percentage.desc()).limit(limit).all()
+        ).filter(Product.is_active == True).order_by(Product.discount_percentage.desc().nulls_last()).limit(limit).all()
         
         return [self._product_to_dict(product) for product in deals]
     